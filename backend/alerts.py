@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+
+from ml.app import HydrateDetector
+
+
+class AlertSuppressor:
+    """
+    Decides which hydrate starts turn into alert emails, so a valve hovering
+    around the threshold does not produce an email per oscillation.
+
+    - Hysteresis: after an alert, a device only re-arms once its readings
+      clear the thresholds by `volume_margin` / `valve_margin`.
+    - Debounce: at most one alert per device every `debounce` seconds of
+      data time.
+    - Token bucket: each recipient gets `burst` alerts, refilled at
+      `rate_per_minute`, in wall-clock time.
+
+    The first alert always goes through. Suppressed starts are counted and
+    the count is handed to the next alert delivered for that device.
+
+    Devices and recipients are kept in least recently used order, like the
+    DetectorRegistry, and dropped from the front on every hydrate start: a
+    device without a start for `idle_timeout` seconds (or the least recent
+    once `max_devices` are tracked), which only re-arms it and loses its
+    suppressed count, and a recipient whose bucket has refilled, which
+    changes nothing.
+    """
+
+    def __init__(self, debounce=900, volume_margin=10, valve_margin=5, rate_per_minute=6, burst=10,
+                 idle_timeout=3600, max_devices=10000):
+        self.debounce = debounce
+        self.volume_margin = volume_margin
+        self.valve_margin = valve_margin
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.idle_timeout = idle_timeout
+        self.max_devices = max_devices
+
+        self._devices = OrderedDict()  # device_key -> state, least recent start first
+        self._buckets = OrderedDict()  # recipient -> (tokens, time.monotonic()), least recently updated first
+        self._lock = threading.Lock()
+        self._suppressed_total = 0
+
+    def observe(self, device_key, volume, valve):
+        """Feed every reading, re-arming the device once it is clearly back to normal"""
+        state = self._devices.get(device_key)
+        if state is not None and not state['armed']:
+            if (volume >= HydrateDetector.VOLUME_THRESHOLD + self.volume_margin
+                    or valve <= HydrateDetector.VALVE_THRESHOLD - self.valve_margin):
+                state['armed'] = True
+
+    def allow(self, device_key, recipient, timestamp):
+        """
+        Called on a hydrate start.
+
+        Returns:
+            tuple: (send, suppressed_count) where suppressed_count is the number
+            of starts held back since the last delivered alert
+        """
+        with self._lock:
+            self._evict_idle()
+            state = self._devices.get(device_key)
+            if state is None:
+                if len(self._devices) >= self.max_devices:
+                    self._devices.popitem(last=False)
+                state = self._devices[device_key] = {'armed': True, 'last_sent': None, 'suppressed': 0}
+            state['seen'] = time.monotonic()
+            self._devices.move_to_end(device_key)
+            debounced = state['last_sent'] is not None and (timestamp - state['last_sent']).total_seconds() < self.debounce
+            send = state['armed'] and not debounced and self._take_token(recipient)
+            state['armed'] = False
+
+            if not send:
+                state['suppressed'] += 1
+                self._suppressed_total += 1
+                return False, state['suppressed']
+
+            suppressed = state['suppressed']
+            state['suppressed'] = 0
+            state['last_sent'] = timestamp
+            return True, suppressed
+
+    def stats(self):
+        return {
+            'devices': len(self._devices),
+            'recipients': len(self._buckets),
+            'suppressed_total': self._suppressed_total,
+        }
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        while self._devices and now - next(iter(self._devices.values()))['seen'] >= self.idle_timeout:
+            self._devices.popitem(last=False)
+        # A bucket left alone this long is full again, the same as a missing one
+        refill = self.burst / self.rate if self.rate else float('inf')
+        while self._buckets and now - next(iter(self._buckets.values()))[1] >= refill:
+            self._buckets.popitem(last=False)
+
+    def _take_token(self, recipient):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(recipient, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        self._buckets[recipient] = (tokens if tokens < 1 else tokens - 1, now)
+        self._buckets.move_to_end(recipient)
+        return tokens >= 1
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class _Entry:
+    """Readings pushed into a well's detector in one go, `seq` is None outside data_batch"""
+    __slots__ = ('seq', 'detector', 'unreleased', 'tickets', 'rejected')
+
+    def __init__(self, seq, detector, unreleased, rejected=False):
+        self.seq = seq
+        self.detector = detector
+        self.unreleased = unreleased
+        self.tickets = []  # (first, last) ingest tickets of the released points
+        self.rejected = rejected
+
+
+class BatchStream:
+    """data_batch state of one well for the session currently feeding it"""
+    __slots__ = ('session', 'next_seq', 'acked', 'watermark', 'sid', 'entries')
+
+    def __init__(self, session, watermark=None):
+        self.session = session
+        self.next_seq = 0
+        self.acked = -1
+        # Rows up to here were stored before this session, skipped until a newer one arrives
+        self.watermark = watermark
+        self.sid = None
+        self.entries = deque()
+
+
+class BatchStreams:
+    """
+    Tracks which data_batch sequences of each well are durably stored.
+
+    A client numbers its batches from 0 within a session and starts a new
+    session on every (re)connect, renumbering whatever was not acknowledged.
+    Batches of a session reach the detector strictly in sequence order.
+
+    The cleaner releases points in the order readings were pushed, possibly
+    during a later batch or a flush, so each push is recorded as an entry and
+    released points are handed to the entries of their detector first in,
+    first out. A batch is acknowledged once its points, and those of every
+    earlier batch, have settled in the ingest buffer. Batches that failed
+    validation or had a row dropped by the database are reported as
+    rejected, since sending them again would not help.
+
+    Args:
+        ingest_buffer: IngestBuffer the released points are queued in
+        max_streams: Number of wells whose stream state is kept
+    """
+
+    def __init__(self, ingest_buffer, max_streams=10000):
+        self.ingest_buffer = ingest_buffer
+        self.max_streams = max_streams
+
+        self._streams = OrderedDict()  # (user_email, device_id) -> BatchStream, least recent first
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+
+    def session(self, key):
+        with self._lock:
+            stream = self._streams.get(key)
+            return stream.session if stream is not None else None
+
+    def claim(self, key, session, seq, detector, watermark=None):
+        """
+        Whether batch `seq` of `session` is next, called under the well's lock.
+        A new session replaces the stream, `watermark` being the newest
+        reading already stored or held for the well. Readings `detector`
+        held back before the well had a stream are recorded first, so their
+        points are never taken for the batch's own.
+
+        Returns:
+            str: 'next', 'duplicate' (already pushed) or 'early'
+        """
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream.session != session:
+                replaced = stream
+                stream = self._streams[key] = BatchStream(session, watermark)
+                if replaced is not None:
+                    # Still released and settled in order, no longer acknowledged
+                    for entry in replaced.entries:
+                        entry.seq = None
+                    stream.entries = replaced.entries
+                elif detector.cleaner.held():
+                    # Pushed through `data`, or before the stream state was dropped
+                    stream.entries.append(_Entry(None, detector, detector.cleaner.held()))
+                while len(self._streams) > self.max_streams:
+                    self._streams.popitem(last=False)
+            self._streams.move_to_end(key)
+            if seq < stream.next_seq:
+                return 'duplicate'
+            return 'next' if seq == stream.next_seq else 'early'
+
+    def wait_turn(self, key, session, seq, timeout):
+        """Block until every batch of `session` before `seq` was pushed, False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._turn:
+            while True:
+                stream = self._streams.get(key)
+                if stream is None or stream.session != session or stream.next_seq >= seq:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._turn.wait(remaining)
+
+    def unstored(self, key, timestamps):
+        """Index of the first of `timestamps` newer than the stream's watermark"""
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream.watermark is None:
+                return 0
+            start = 0
+            while start < len(timestamps) and timestamps[start] <= stream.watermark:
+                start += 1
+            if start < len(timestamps):
+                stream.watermark = None
+            return start
+
+    def push(self, key, seq, detector, count, rejected=False, sid=None):
+        """
+        Record `count` readings pushed into `detector`, as batch `seq` or,
+        with seq None, from outside data_batch. Call it under the well's lock
+        before the readings are processed.
+        """
+        with self._turn:
+            stream = self._streams.get(key)
+            if stream is None:
+                return
+            stream.entries.append(_Entry(seq, detector, count, rejected))
+            if seq is not None:
+                stream.next_seq = seq + 1
+                if sid is not None:
+                    stream.sid = sid
+                self._turn.notify_all()
+
+    def released(self, key, detector, tickets):
+        """Hand the ingest tickets of points `detector` released to the oldest entries waiting for them"""
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                return
+            taken = 0
+            for entry in stream.entries:
+                if taken == len(tickets):
+                    break
+                if entry.detector is not detector or not entry.unreleased:
+                    continue
+                count = min(entry.unreleased, len(tickets) - taken)
+                entry.tickets.append((tickets[taken], tickets[taken + count - 1]))
+                entry.unreleased -= count
+                taken += count
+
+    def settle(self, key, timeout=None):
+        """
+        Acknowledge the batches at the front of the stream whose points have
+        all settled, waiting up to `timeout` seconds for the ingest buffer.
+
+        Returns:
+            tuple: (stream, acked seq, seqs rejected among the newly acked), stream None if unknown
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        rejected = []
+        with self._lock:
+            stream = self._streams.get(key)
+        if stream is None:
+            return None, -1, rejected
+
+        while True:
+            with self._lock:
+                if not stream.entries or stream.entries[0].unreleased:
+                    break
+                entry = stream.entries[0]
+            if entry.tickets:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if not self.ingest_buffer.wait(entry.tickets[-1][1], timeout=remaining):
+                    break
+            dropped = entry.rejected or (entry.tickets and self.ingest_buffer.dropped(entry.tickets))
+            with self._lock:
+                if not stream.entries or stream.entries[0] is not entry:
+                    continue
+                stream.entries.popleft()
+                if entry.seq is not None:
+                    stream.acked = entry.seq
+                    if dropped:
+                        rejected.append(entry.seq)
+        return stream, stream.acked, rejected
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': len(self._streams),
+                'max_streams': self.max_streams,
+            }
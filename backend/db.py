@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from logging import getLogger
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = getLogger()
+
+# Under the eventlet worker psycopg2 would block the whole hub while waiting on
+# the socket, so hand its wait loop over to eventlet when psycogreen is around.
+try:
+    from eventlet import patcher as _eventlet_patcher
+    if _eventlet_patcher.is_monkey_patched('socket'):
+        from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of psycopg2 connections shared by the REST routes and the
+    Socket.IO handlers.
+
+    It only relies on `threading` primitives, which the eventlet worker
+    monkey-patches into greenlet-aware versions, so a greenlet waiting for a
+    free connection yields instead of blocking the worker.
+
+    Args:
+        connect: Zero-argument callable returning a new psycopg2 connection
+        maxconn: Maximum number of connections open at the same time
+        max_lifetime: Seconds after which a connection is closed and replaced
+        health_check_after: Idle seconds after which a connection is pinged
+            with `SELECT 1` before being handed out again
+        timeout: Seconds to wait for a free connection before giving up
+    """
+
+    def __init__(self, connect, maxconn=10, max_lifetime=1800, health_check_after=30, timeout=10):
+        self._connect = connect
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = deque()  # (conn, last_used)
+        self._created_at = {}
+        self._in_use = 0
+
+        self._stats = {
+            'connections_opened': 0,
+            'connections_recycled': 0,
+            'health_check_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'max_wait_ms': 0.0,
+        }
+
+    def getconn(self):
+        """Check a connection out of the pool, opening a new one if needed"""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['waits'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], waited_ms)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is unusable"""
+        try:
+            if not close and not conn.closed:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if close or conn.closed or self._expired(conn):
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Pool saturation metrics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_use'] = self._in_use
+            stats['idle'] = len(self._idle)
+        stats['max_connections'] = self.maxconn
+        stats['saturation'] = round(stats['in_use'] / self.maxconn, 3)
+        return stats
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._created_at[conn] = time.monotonic()
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+
+            if conn.closed or self._expired(conn):
+                self._discard(conn)
+                continue
+            if time.monotonic() - last_used > self.health_check_after and not self._healthy(conn):
+                with self._lock:
+                    self._stats['health_check_failures'] += 1
+                self._discard(conn)
+                continue
+            return conn
+
+    def _healthy(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Pooled connection failed health check: {str(e)}")
+            return False
+
+    def _expired(self, conn):
+        created_at = self._created_at.get(conn)
+        return created_at is not None and time.monotonic() - created_at > self.max_lifetime
+
+    def _discard(self, conn):
+        with self._lock:
+            if self._created_at.pop(conn, None) is not None:
+                self._stats['connections_recycled'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
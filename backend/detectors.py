@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from logging import getLogger
+
+from ml.app import HydrateDetector
+
+logger = getLogger()
+
+
+class DetectorRegistry:
+    """
+    One HydrateDetector per (user_email, device_id), so every well keeps its
+    own event state and sliding windows.
+
+    Detectors are kept in least recently used order, so dropping one once
+    `max_detectors` are live, or finding the idle ones, never scans the
+    others. Detectors that have not seen a point for `idle_timeout` seconds
+    are dropped by `evict_idle`.
+
+    A detector missing from the registry is built by `loader` when one is
+    set (e.g. from its snapshot), by `factory` otherwise. Looking up a live
+    detector is a plain dict read. The registry lock is
+    only taken to create one, or to move it in the recency order, which
+    happens at most once per `touch_interval` seconds per well, so the order
+    and `seen_since` are that coarse.
+
+    A detector's cleaner holds the last readings back until it has seen the
+    following ones. Once a well has been quiet for `flush_after` seconds,
+    and before its detector is dropped, the `run` loop releases them through
+    `detector.flush_raw()` and hands the points to
+    `on_flush(key, detector, points)`, under the well's lock from `lock_for`.
+    Callers feeding a detector take the same lock, so a flush never
+    interleaves with new readings.
+
+    Args:
+        factory: Callable creating a new detector
+        max_detectors: Upper bound on the number of live detectors
+        idle_timeout: Seconds without data after which a detector is dropped
+        flush_after: Seconds without data after which held readings are released
+        on_flush: Callable receiving ((user_email, device_id), detector, points) for released points
+        touch_interval: Seconds a well's place in the recency order may lag behind
+    """
+
+    def __init__(self, factory=HydrateDetector, max_detectors=10000, idle_timeout=3600, flush_after=300, on_flush=None, touch_interval=1.0):
+        self.factory = factory
+        self.max_detectors = max_detectors
+        self.idle_timeout = idle_timeout
+        self.flush_after = flush_after
+        self.on_flush = on_flush
+        self.touch_interval = touch_interval
+        # Optional (user_email, device_id) -> detector or None, e.g. restoring a snapshot
+        self.loader = None
+
+        self._detectors = {}
+        self._last_seen = OrderedDict()  # key -> time.monotonic(), least recent first
+        self._unflushed = OrderedDict()  # same, only detectors that saw a point since their last flush
+        self._dropped = deque()  # (key, detector) evicted with readings still held
+        self._lock = threading.Lock()
+        # Striped, so locks never have to be created or cleaned up per well
+        self._well_locks = [threading.Lock() for _ in range(64)]
+        self._running = False
+        self._evicted = 0
+        self._flushes = 0
+
+    def get(self, user_email, device_id):
+        key = (user_email, device_id)
+        detector = self._detectors.get(key)
+        if detector is not None and key in self._unflushed:
+            seen = self._last_seen.get(key)
+            if seen is not None and time.monotonic() - seen < self.touch_interval:
+                return detector
+
+        with self._lock:
+            detector = self._detectors.get(key)
+            if detector is not None:
+                self._touch(key)
+                return detector
+
+        # Outside the lock, the loader may query the database
+        loaded = None
+        if self.loader is not None:
+            try:
+                loaded = self.loader(user_email, device_id)
+            except Exception as e:
+                logger.error(f"Could not load the detector of {device_id}: {str(e)}")
+
+        with self._lock:
+            detector = self._detectors.get(key)
+            if detector is None:
+                if len(self._detectors) >= self.max_detectors:
+                    self._evict_least_recent()
+                detector = loaded if loaded is not None else self.factory()
+                self._detectors[key] = detector
+            self._touch(key)
+        return detector
+
+    def seen_since(self, since):
+        """(key, detector) pairs that received points after `since` (time.monotonic())"""
+        seen = []
+        with self._lock:
+            for key in reversed(self._last_seen):
+                if self._last_seen[key] < since:
+                    break
+                seen.append((key, self._detectors[key]))
+        return seen
+
+    def lock_for(self, user_email, device_id):
+        """Lock serializing everything that feeds the detector of a well"""
+        return self._well_locks[hash((user_email, device_id)) % len(self._well_locks)]
+
+    def flush_quiet(self):
+        """Release the held readings of wells quiet for `flush_after` seconds"""
+        cutoff = time.monotonic() - self.flush_after
+        quiet = []
+        with self._lock:
+            while self._unflushed and next(iter(self._unflushed.values())) < cutoff:
+                key, _ = self._unflushed.popitem(last=False)
+                quiet.append((key, self._detectors[key]))
+        for key, detector in quiet:
+            self._flush(key, detector)
+        return len(quiet)
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = 0
+        with self._lock:
+            while self._last_seen and next(iter(self._last_seen.values())) < cutoff:
+                self._evict_least_recent()
+                evicted += 1
+        return evicted
+
+    def run(self):
+        """Background loop flushing quiet detectors and evicting idle ones"""
+        self._running = True
+        interval = min(self.idle_timeout / 4, self.flush_after / 2)
+        while self._running:
+            time.sleep(max(interval, 1))
+            self.flush_quiet()
+            self.evict_idle()
+            while self._dropped:
+                self._flush(*self._dropped.popleft())
+
+    def flush_all(self):
+        """Release every held reading, e.g. on shutdown"""
+        with self._lock:
+            pending = [(key, self._detectors[key]) for key in self._unflushed]
+            self._unflushed.clear()
+        for key, detector in pending + list(self._dropped):
+            self._flush(key, detector)
+        self._dropped.clear()
+
+    def stats(self):
+        return {
+            'detectors': len(self._detectors),
+            'max_detectors': self.max_detectors,
+            'evicted': self._evicted,
+            'flushes': self._flushes,
+        }
+
+    def _touch(self, key):
+        now = time.monotonic()
+        self._last_seen[key] = now
+        self._last_seen.move_to_end(key)
+        self._unflushed[key] = now
+        self._unflushed.move_to_end(key)
+
+    def _evict_least_recent(self):
+        if self._last_seen:
+            key, _ = self._last_seen.popitem(last=False)
+            detector = self._detectors.pop(key, None)
+            if self._unflushed.pop(key, None) is not None:
+                # Flushed by the run loop, the caller may hold another well's lock
+                self._dropped.append((key, detector))
+            self._evicted += 1
+
+    def _flush(self, key, detector):
+        try:
+            with self.lock_for(*key):
+                points = detector.flush_raw()
+                if points and self.on_flush is not None:
+                    self.on_flush(key, detector, points)
+            self._flushes += 1
+        except Exception as e:
+            logger.error(f"Error flushing the detector of {key[1]}: {str(e)}")
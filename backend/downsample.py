@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def _fill_missing(y):
+    """Missing readings only matter for point selection, not for the output"""
+    finite = np.isfinite(y)
+    if finite.all():
+        return y
+    fill = np.median(y[finite]) if finite.any() else 0.0
+    return np.where(finite, y, fill)
+
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets: indices of at most `max_points` points that
+    keep the visual shape of the series. `x` must be ascending.
+    """
+    x = np.asarray(x, dtype=float)
+    y = _fill_missing(np.asarray(y, dtype=float))
+    count = len(x)
+    if max_points >= count or max_points < 3:
+        return np.arange(count)
+
+    # Bucket boundaries for every point but the first and the last, which are always kept
+    edges = np.linspace(1, count - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket == max_points - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(x, y, bucket):
+    """
+    Indices of the first, lowest and highest point of every `bucket`-wide
+    interval of `x`, plus the last point, which keeps spikes and drops that
+    averaging would hide. `x` must be ascending.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if not len(x):
+        return np.arange(0)
+
+    bucket_ids = ((x - x[0]) // bucket).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_ids)) + 1))
+    ends = np.append(starts[1:], len(x))
+
+    selected = [starts, [len(x) - 1]]
+    for start, end in zip(starts, ends):
+        values = y[start:end]
+        if np.isnan(values).all():
+            continue
+        selected.append([start + np.nanargmin(values), start + np.nanargmax(values)])
+    return np.unique(np.concatenate(selected))
+
+
+def downsample_indices(x, y, keep, max_points=None, bucket=None):
+    """
+    Row indices to return for a chart query, always including the rows in `keep`
+    (e.g. hydrate start and end markers).
+
+    Args:
+        x: Ascending timestamps as numbers
+        y: Series driving the point selection
+        keep: Boolean mask of rows that must survive
+        max_points: Target number of points for LTTB
+        bucket: Interval width, in units of `x`, for min/max bucketing applied
+            before LTTB
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    indices = np.arange(len(x))
+    if bucket is not None:
+        indices = minmax_indices(x, y, bucket)
+    if max_points is not None:
+        indices = indices[lttb_indices(x[indices], y[indices], max_points)]
+    return np.union1d(indices, np.flatnonzero(keep))
@@ -0,0 +1,364 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging import getLogger
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import rollups
+from db import PoolTimeout
+
+logger = getLogger()
+
+# Length of the VARCHAR key columns of gas_meter_data
+MAX_KEY_LENGTH = 255
+
+
+class IngestBufferFull(Exception):
+    pass
+
+
+class KnownDevices:
+    """
+    Process-local LRU of (device_id, email) pairs that already exist in the
+    `devices` table, so registering a device costs a query only the first
+    time this process sees it.
+
+    Args:
+        max_size: Number of pairs kept before the least recently seen is dropped
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._pairs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm(self, pool):
+        """Load the registered devices from the database"""
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT device_id, email FROM devices ORDER BY created_at DESC LIMIT %s", (self.max_size,))
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            pool.putconn(conn)
+        self.add((row['device_id'], row['email']) for row in reversed(rows))
+        return len(rows)
+
+    def missing(self, pairs):
+        """Return the pairs not known to be registered yet"""
+        unknown = []
+        with self._lock:
+            for pair in pairs:
+                if pair in self._pairs:
+                    self._pairs.move_to_end(pair)
+                else:
+                    unknown.append(pair)
+        return unknown
+
+    def add(self, pairs):
+        with self._lock:
+            for pair in pairs:
+                self._pairs[pair] = True
+                self._pairs.move_to_end(pair)
+            while len(self._pairs) > self.max_size:
+                self._pairs.popitem(last=False)
+
+    def __len__(self):
+        return len(self._pairs)
+
+
+class IngestBuffer:
+    """
+    Buffers telemetry rows in memory and writes them to `gas_meter_data` with
+    multi-row inserts once `flush_size` rows are waiting or the oldest row has
+    waited `flush_interval` seconds. The rollup tables are updated in the same
+    transaction. Rows are validated before they are queued, and a row the
+    database still rejects (e.g. an unknown user) is isolated by bisecting
+    the batch, so only that row is dropped.
+
+    Rows are written by the `run` loop, which is woken as soon as a batch is
+    complete, so producers never wait on the database. Producers hold room
+    for their rows with `reserve` before queueing them with `add_many`.
+    Room counts the pending rows plus every reservation held, and when it
+    runs out `reserve` blocks for up to `block_timeout` seconds before
+    raising `IngestBufferFull`, so memory stays bounded by `max_rows`.
+
+    Every queued row gets a ticket, rows settle (get written or dropped) in
+    ticket order, `wait` blocks until a ticket has settled and `dropped`
+    tells whether any of a set of tickets was dropped.
+
+    Args:
+        pool: ConnectionPool used for flushing
+        known_devices: KnownDevices cache consulted before registering devices
+        flush_size: Number of pending rows that triggers a flush
+        flush_interval: Maximum age in seconds of a pending row
+        max_rows: Number of pending rows at which producers are held back
+        block_timeout: Seconds a producer waits for room in a full buffer
+    """
+
+    def __init__(self, pool, known_devices, flush_size=500, flush_interval=0.25, max_rows=20000, block_timeout=5):
+        self.pool = pool
+        self.known_devices = known_devices
+        # Set when gas_meter_data is partitioned, so batches can create missing months
+        self.partition_cache = None
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.block_timeout = block_timeout
+
+        self._rows = []
+        self._reserved = 0
+        self._oldest_at = None
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._settled = threading.Condition(self._lock)
+        # Rows settle (get written or dropped) in the order they were added
+        self._settled_through = 0
+        self._dropped_ranges = deque(maxlen=10000)
+        self._batch_ready = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._running = False
+
+        self._stats = {
+            'rows_received': 0,
+            'rows_flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'rows_dropped': 0,
+            'last_flush_ms': 0.0,
+            'producer_waits': 0,
+        }
+
+    def add(self, device_id, user_email, timestamp, volume, setpoint, valve):
+        """
+        Queue one row, waiting for room in a full buffer.
+
+        Returns:
+            int: Ticket to pass to `wait` to learn when the row is durable
+        """
+        with self.reserve(1):
+            return self.add_many([(device_id, user_email, timestamp, volume, setpoint, valve)])[0]
+
+    @contextmanager
+    def reserve(self, count):
+        """
+        Hold room for up to `count` rows while the block runs, waiting for it
+        and raising IngestBufferFull after `block_timeout`.
+        """
+        with self._not_full:
+            if not self._fits(count):
+                self._stats['producer_waits'] += 1
+                deadline = time.monotonic() + self.block_timeout
+                while not self._fits(count):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise IngestBufferFull(f"{len(self._rows)} rows waiting to be written")
+                    self._not_full.wait(remaining)
+            self._reserved += count
+        try:
+            yield
+        finally:
+            with self._not_full:
+                self._reserved -= count
+                self._not_full.notify_all()
+
+    def add_many(self, rows):
+        """
+        Queue (device_id, user_email, timestamp, volume, setpoint, valve)
+        rows without waiting, inside a `reserve` block holding room for them.
+
+        Returns:
+            list: Consecutive tickets, one per row
+        """
+        for row in rows:
+            self.validate(*row[:3])
+        if not rows:
+            return []
+        with self._lock:
+            if not self._rows:
+                self._oldest_at = time.monotonic()
+            self._rows.extend(rows)
+            first = self._stats['rows_received'] + 1
+            self._stats['rows_received'] += len(rows)
+            if len(self._rows) >= self.flush_size:
+                self._batch_ready.set()
+        return list(range(first, first + len(rows)))
+
+    @staticmethod
+    def validate(device_id, user_email, timestamp):
+        """Raise ValueError for a row the insert would fail on"""
+        for name, value in (('device_id', device_id), ('user_email', user_email)):
+            if not isinstance(value, str) or not value or len(value) > MAX_KEY_LENGTH:
+                raise ValueError(f"{name} must be a string of 1 to {MAX_KEY_LENGTH} characters")
+        if not isinstance(timestamp, datetime):
+            raise ValueError(f"timestamp must be a datetime, got {timestamp!r}")
+
+    def wait(self, ticket, timeout=None):
+        """Block until the row behind `ticket`, and every row queued before it, has settled. False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._settled:
+            while self._settled_through < ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._settled.wait(remaining)
+            return True
+
+    def dropped(self, ranges):
+        """Whether any ticket of the inclusive (first, last) `ranges` was dropped"""
+        with self._lock:
+            return any(
+                start <= last and first <= end
+                for first, last in ranges
+                for start, end in self._dropped_ranges
+            )
+
+    def flush(self):
+        """Write every pending row in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._oldest_at = None
+            if not rows:
+                return 0
+
+            started = time.monotonic()
+            try:
+                rejected = self._write(rows)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout) as e:
+                logger.error(f"Error flushing {len(rows)} telemetry rows, will retry: {str(e)}")
+                with self._not_full:
+                    # Keep the rows for the next attempt, ahead of newer ones
+                    self._rows = rows + self._rows
+                    self._oldest_at = started
+                    self._stats['flush_errors'] += 1
+                return 0
+            except Exception as e:
+                # Not something a single row can cause, retrying would not help
+                logger.error(f"Dropping {len(rows)} telemetry rows: {str(e)}")
+                rejected = range(len(rows))
+
+            with self._not_full:
+                first = self._settled_through + 1
+                for start, end in self._index_ranges(rejected):
+                    self._dropped_ranges.append((first + start, first + end))
+                stored = len(rows) - len(rejected)
+                if rejected:
+                    self._stats['flush_errors'] += 1
+                    self._stats['rows_dropped'] += len(rejected)
+                if stored:
+                    self._stats['rows_flushed'] += stored
+                    self._stats['flushes'] += 1
+                    self._stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+                self._settled_through += len(rows)
+                self._not_full.notify_all()
+                self._settled.notify_all()
+            return stored
+
+    def run(self):
+        """Background loop flushing complete batches and rows that have waited `flush_interval`"""
+        self._running = True
+        while self._running:
+            self._batch_ready.wait(self.flush_interval / 2)
+            self._batch_ready.clear()
+            with self._lock:
+                due = len(self._rows) >= self.flush_size or (
+                    self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.flush_interval
+                )
+            if due:
+                self.flush()
+
+    def close(self):
+        """Stop the background loop and write whatever is still pending"""
+        self._running = False
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['rows_pending'] = len(self._rows)
+            stats['rows_reserved'] = self._reserved
+        return stats
+
+    def _write(self, rows):
+        """Insert the batch in one transaction, returns the indices of the rows the database rejected"""
+        conn = self.pool.getconn()
+        try:
+            cur = conn.cursor()
+            if self.partition_cache is not None:
+                self.partition_cache.ensure(cur, [row[2] for row in rows])
+            rejected = self._insert(cur, rows, 0)
+            if rejected:
+                skipped = set(rejected)
+                rows = [row for i, row in enumerate(rows) if i not in skipped]
+
+            devices = []
+            if rows:
+                rollups.apply_rows(cur, rows)
+
+                devices = self.known_devices.missing({(row[0], row[1]) for row in rows})
+                if devices:
+                    execute_values(cur, """
+                        INSERT INTO devices (device_id, email)
+                        VALUES %s
+                        ON CONFLICT (device_id, email) DO NOTHING
+                    """, devices)
+
+            conn.commit()
+            cur.close()
+        finally:
+            self.pool.putconn(conn)
+        self.known_devices.add(devices)
+        return rejected
+
+    def _insert(self, cur, rows, offset):
+        """
+        Insert rows under a savepoint. When the database rejects the batch
+        because of its data, the halves are retried until the offending rows
+        are isolated, their indices (from `offset`) are returned.
+        """
+        cur.execute("SAVEPOINT ingest_rows")
+        try:
+            execute_values(cur, """
+                INSERT INTO gas_meter_data (
+                    device_id,
+                    user_email,
+                    timestamp,
+                    gas_meter_volume_instant,
+                    gas_meter_volume_setpoint,
+                    gas_valve_percent_open
+                )
+                VALUES %s
+            """, rows, page_size=self.flush_size)
+        except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT ingest_rows")
+            cur.execute("RELEASE SAVEPOINT ingest_rows")
+            if len(rows) == 1:
+                logger.error(f"Dropping telemetry row of {rows[0][0]} at {rows[0][2]}: {str(e)}")
+                return [offset]
+            middle = len(rows) // 2
+            return self._insert(cur, rows[:middle], offset) + self._insert(cur, rows[middle:], offset + middle)
+        cur.execute("RELEASE SAVEPOINT ingest_rows")
+        return []
+
+    def _fits(self, count):
+        # Rows added inside a reservation count twice until it ends, erring on
+        # the safe side. An empty buffer takes any batch, so one larger than
+        # max_rows cannot wait forever
+        return not self._rows and not self._reserved or len(self._rows) + self._reserved + count <= self.max_rows
+
+    @staticmethod
+    def _index_ranges(indices):
+        """Sorted indices as inclusive (start, end) runs"""
+        ranges = []
+        for index in indices:
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return [tuple(run) for run in ranges]
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+
+from timestamps import epoch_millis
+
+
+def nullable(values):
+    """NaN readings as None, JSON has no NaN"""
+    return [None if value != value else value for value in values]
+
+
+def device_room(user_email, device_id):
+    return f"device:{user_email}:{device_id}"
+
+
+class LiveFeed:
+    """
+    Pushes classified telemetry to dashboards subscribed to a device's
+    Socket.IO room, instead of dashboards polling /api/historical-data.
+
+    `publish` only buffers the point, and only for rooms that have
+    subscribers. The `run` loop coalesces each room's buffer into a single
+    `telemetry` event every `interval` seconds, so a subscriber never gets
+    more than 1 / `interval` updates per second per device however fast the
+    well reports. Every subscriber of a room receives the same stream, so the
+    room rate is the subscriber rate. At most `max_points` points are buffered
+    per room between updates (the oldest are dropped and counted), hydrate
+    start/end events are always delivered.
+
+    With several backend processes, a dashboard has to be connected to the
+    process its device reports to (the load balancer routes by device_id),
+    so the subscribers seen here are all the subscribers there are.
+
+    Args:
+        socketio: SocketIO instance used to emit
+        interval: Seconds between updates of a room
+        max_points: Points buffered per room between two updates
+    """
+
+    def __init__(self, socketio, interval=0.5, max_points=1000):
+        self.socketio = socketio
+        self.interval = interval
+        self.max_points = max_points
+
+        self._subscriptions = {}  # sid -> {room: device_id}
+        self._subscribers = {}  # room -> subscriber count
+        self._pending = {}  # room -> {'device_id', 'points', 'events', 'dropped'}
+        self._lock = threading.Lock()
+        self._running = False
+        self._stats = {'published': 0, 'updates': 0, 'dropped': 0}
+
+    def subscribe(self, sid, user_email, device_id):
+        """Register a subscription and return the room the client has to join"""
+        room = device_room(user_email, device_id)
+        with self._lock:
+            rooms = self._subscriptions.setdefault(sid, {})
+            if room not in rooms:
+                rooms[room] = device_id
+                self._subscribers[room] = self._subscribers.get(room, 0) + 1
+        return room
+
+    def rooms(self, sid, device_id=None):
+        """Rooms `sid` is subscribed to, optionally only those of `device_id`"""
+        rooms = self._subscriptions.get(sid, {})
+        return [room for room, room_device in list(rooms.items()) if device_id is None or room_device == device_id]
+
+    def unsubscribe(self, sid, room=None):
+        """Remove one subscription, or every subscription of `sid` when room is None"""
+        with self._lock:
+            rooms = self._subscriptions.get(sid, {})
+            for name in ([room] if room is not None else list(rooms)):
+                if name not in rooms:
+                    continue
+                del rooms[name]
+                self._subscribers[name] -= 1
+                if not self._subscribers[name]:
+                    del self._subscribers[name]
+                    self._pending.pop(name, None)
+            if not rooms:
+                self._subscriptions.pop(sid, None)
+
+    def publish(self, user_email, device_id, timestamp, volume, setpoint, valve, in_event, event=None):
+        """Buffer one classified point, `event` is "start" or "end" on hydrate transitions"""
+        room = device_room(user_email, device_id)
+        if room not in self._subscribers:
+            return
+        with self._lock:
+            pending = self._pending.get(room)
+            if pending is None:
+                pending = {'device_id': device_id, 'points': deque(maxlen=self.max_points), 'events': [], 'dropped': 0}
+                self._pending[room] = pending
+            if len(pending['points']) == self.max_points:
+                pending['dropped'] += 1
+                self._stats['dropped'] += 1
+            pending['points'].append((timestamp, volume, setpoint, valve, in_event))
+            if event is not None:
+                pending['events'].append((event, timestamp))
+            self._stats['published'] += 1
+
+    def flush(self):
+        """Emit one coalesced update per room with new points"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for room, update in pending.items():
+            timestamps, volume, setpoint, valve, in_event = zip(*update['points'])
+            events = update['events']
+            event_times = epoch_millis([timestamp for _, timestamp in events])
+            self.socketio.emit('telemetry', {
+                'device_id': update['device_id'],
+                'timestamp': epoch_millis(timestamps),
+                'gas_meter_volume_instant': nullable(volume),
+                'gas_meter_volume_setpoint': nullable(setpoint),
+                'gas_valve_percent_open': nullable(valve),
+                'in_hydrate_event': list(in_event),
+                'events': [{'type': event, 'timestamp': event_time} for (event, _), event_time in zip(events, event_times)],
+                'dropped': update['dropped'],
+            }, to=room)
+            self._stats['updates'] += 1
+        return len(pending)
+
+    def run(self):
+        """Background loop emitting coalesced updates"""
+        self._running = True
+        while self._running:
+            started = time.monotonic()
+            self.flush()
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def close(self):
+        self._running = False
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['rooms'] = len(self._subscribers)
+        stats['subscribers'] = len(self._subscriptions)
+        return stats
@@ -0,0 +1,188 @@
+import re
+import time
+from datetime import datetime
+from logging import getLogger
+
+import psycopg2
+
+import rollups
+
+logger = getLogger()
+
+PARTITION_NAME = re.compile(r'^gas_meter_data_y(\d{4})m(\d{2})$')
+# Advisory lock serializing schema changes between backend processes
+SCHEMA_LOCK_ID = 2024111501
+
+
+def month_start(timestamp):
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"gas_meter_data_y{month.year:04d}m{month.month:02d}"
+
+
+def create_partitioned_table(cur):
+    """Create `gas_meter_data` range-partitioned by month on `timestamp`"""
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS gas_meter_data_id_seq")
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS gas_meter_data (
+            id INTEGER NOT NULL DEFAULT nextval('gas_meter_data_id_seq'),
+            device_id VARCHAR(255) NOT NULL,
+            user_email VARCHAR(255) NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            gas_meter_volume_instant FLOAT,
+            gas_meter_volume_setpoint FLOAT,
+            gas_valve_percent_open FLOAT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp),
+            FOREIGN KEY (user_email) REFERENCES users(email)
+        ) PARTITION BY RANGE (timestamp)
+    ''')
+    cur.execute("ALTER SEQUENCE gas_meter_data_id_seq OWNED BY gas_meter_data.id")
+    # Catches rows for months whose partition could not be created
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS gas_meter_data_default
+        PARTITION OF gas_meter_data DEFAULT
+    ''')
+
+
+def is_partitioned(cur):
+    cur.execute("""
+        SELECT c.relkind AS relkind
+        FROM pg_class c
+        WHERE c.oid = to_regclass('gas_meter_data')
+    """)
+    row = cur.fetchone()
+    return row is not None and row['relkind'] == 'p'
+
+
+def table_exists(cur):
+    cur.execute("SELECT to_regclass('gas_meter_data') IS NOT NULL AS present")
+    return cur.fetchone()['present']
+
+
+def migrate_to_partitioned(cur):
+    """
+    Move an existing plain `gas_meter_data` table into the partitioned layout,
+    keeping row ids. Runs in the caller's transaction.
+    """
+    print("Migrating gas_meter_data to monthly partitions...")
+    cur.execute("ALTER TABLE gas_meter_data RENAME TO gas_meter_data_legacy")
+    cur.execute("ALTER INDEX IF EXISTS gas_meter_data_pkey RENAME TO gas_meter_data_legacy_pkey")
+    cur.execute("DROP INDEX IF EXISTS idx_gas_meter_timestamp")
+    # Keep the id sequence alive when the legacy table is dropped
+    cur.execute("ALTER SEQUENCE gas_meter_data_id_seq OWNED BY NONE")
+
+    create_partitioned_table(cur)
+
+    cur.execute("SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM gas_meter_data_legacy")
+    bounds = cur.fetchone()
+    if bounds['first'] is not None:
+        month = month_start(bounds['first'])
+        while month <= bounds['last']:
+            create_partition(cur, month)
+            month = add_months(month, 1)
+
+    cur.execute('''
+        INSERT INTO gas_meter_data (
+            id, device_id, user_email, timestamp, gas_meter_volume_instant,
+            gas_meter_volume_setpoint, gas_valve_percent_open, created_at
+        )
+        SELECT
+            id, device_id, user_email, timestamp, gas_meter_volume_instant,
+            gas_meter_volume_setpoint, gas_valve_percent_open, created_at
+        FROM gas_meter_data_legacy
+    ''')
+    cur.execute("DROP TABLE gas_meter_data_legacy")
+    print("Migration to monthly partitions complete!")
+
+
+def create_partition(cur, month):
+    start = month_start(month)
+    cur.execute(f'''
+        CREATE TABLE IF NOT EXISTS {partition_name(start)}
+        PARTITION OF gas_meter_data
+        FOR VALUES FROM (%s) TO (%s)
+    ''', (start, add_months(start, 1)))
+
+
+def ensure_future_partitions(cur, months_ahead):
+    month = month_start(datetime.utcnow())
+    for offset in range(months_ahead + 1):
+        create_partition(cur, add_months(month, offset))
+
+
+def retention_cutoff(retention_months):
+    """Start of the oldest month kept with `retention_months` of retention"""
+    return add_months(month_start(datetime.utcnow()), -retention_months)
+
+
+def drop_expired_partitions(cur, retention_months):
+    """Drop monthly partitions that ended more than `retention_months` ago"""
+    cutoff = retention_cutoff(retention_months)
+    cur.execute("""
+        SELECT c.relname AS name
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'gas_meter_data'::regclass
+    """)
+    dropped = []
+    for row in cur.fetchall():
+        match = PARTITION_NAME.match(row['name'])
+        if match and add_months(datetime(int(match.group(1)), int(match.group(2)), 1), 1) <= cutoff:
+            cur.execute(f"DROP TABLE {row['name']}")
+            dropped.append(row['name'])
+    return dropped
+
+
+class PartitionCache:
+    """
+    Months this process knows to have a partition, so ingest only creates one
+    the first time a batch reaches a new month (e.g. replays of old CSVs).
+    """
+
+    def __init__(self):
+        self._months = set()
+
+    def ensure(self, cur, timestamps):
+        for month in {month_start(timestamp) for timestamp in timestamps} - self._months:
+            cur.execute("SAVEPOINT ensure_partition")
+            try:
+                create_partition(cur, month)
+                cur.execute("RELEASE SAVEPOINT ensure_partition")
+            except psycopg2.Error as e:
+                # Usually rows for that month already sit in the default partition
+                cur.execute("ROLLBACK TO SAVEPOINT ensure_partition")
+                logger.error(f"Could not create partition {partition_name(month)}: {str(e)}")
+            self._months.add(month)
+
+
+def run_maintenance(pool, interval, months_ahead, retention_months=None):
+    """Background loop creating upcoming partitions and dropping expired ones along with their rollups"""
+    while True:
+        conn = None
+        try:
+            conn = pool.getconn()
+            cur = conn.cursor()
+            # Every backend process runs this loop, one pass at a time is enough
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS acquired", (SCHEMA_LOCK_ID,))
+            if cur.fetchone()['acquired']:
+                ensure_future_partitions(cur, months_ahead)
+                if retention_months:
+                    for name in drop_expired_partitions(cur, retention_months):
+                        print(f"{datetime.now()} - Dropped expired partition {name}")
+                    rollups.prune(cur, retention_cutoff(retention_months))
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            logger.error(f"Partition maintenance error: {str(e)}")
+        finally:
+            if conn is not None:
+                pool.putconn(conn)
+        time.sleep(interval)
@@ -1,23 +1,70 @@
 import pika
 import os
+import json
+import queue
+import time
+from collections import deque
+from datetime import datetime
+from logging import getLogger
+
+logger = getLogger()
 
 class RabbitMQ:
-    def __init__(self):
-        self.user = os.getenv('RABBITMQ_USER', 'user')
-        self.password = os.getenv('RABBITMQ_PASSWORD', 'password')
-        self.host = os.getenv('RABBITMQ_HOST', 'localhost')
-        self.port = int(os.getenv('RABBITMQ_PORT', 5672))
+    """
+    Long-lived RabbitMQ publisher, one per process.
+
+    Callers hand messages to `enqueue`, which never touches the network. The
+    `run` loop owns the connection: it publishes with publisher confirms,
+    reconnects with backoff when the broker goes away and keeps undelivered
+    messages in a bounded spool (optionally persisted to `spool_path` on
+    shutdown) until the broker is back.
+
+    Args:
+        max_pending: Messages accepted by `enqueue` before it starts rejecting
+        max_spool: Undelivered messages kept while the broker is unreachable
+        spool_path: File the spool is saved to on `close` and loaded from on start
+        durable: Whether queues are declared durable, must match the consumers
+    """
+
+    def __init__(self, max_pending=10000, max_spool=10000, spool_path=None, durable=False):
+        self.user = os.getenv('RABBITMQ_USER')
+        self.password = os.getenv('RABBITMQ_PASSWORD')
+        self.host = os.getenv('RABBIT_HOST', 'localhost')
+        self.port = int(os.getenv('RABBIT_PORT') or 5672)
+        self.durable = durable
+        self.spool_path = spool_path
         self.connection = None
         self.channel = None
-        self.connect()
+
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._spool = deque(maxlen=max_spool)
+        self._declared = set()
+        self._running = False
+        self._stats = {
+            'published': 0,
+            'publish_failures': 0,
+            'rejected': 0,
+            'reconnects': 0,
+            'last_latency_ms': 0.0,
+        }
+        self._load_spool()
 
     def connect(self):
-        credentials = pika.PlainCredentials(self.user, self.password)
-        parameters = pika.ConnectionParameters(host=self.host, port=self.port, credentials=credentials)
-        self.connection = pika.BlockingConnection(parameters)
+        parameters = {'host': self.host, 'port': self.port}
+        # Fall back to the broker's default account when no credentials are configured
+        if self.user:
+            parameters['credentials'] = pika.PlainCredentials(self.user, self.password)
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(**parameters))
         self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        self._declared = set()
 
     def close(self):
+        self._running = False
+        # Whatever has not gone out yet is kept for the next start
+        while not self._pending.empty():
+            self._spool.append(self._pending.get_nowait())
+        self._save_spool()
         if self.connection and not self.connection.is_closed:
             self.connection.close()
 
@@ -28,13 +75,101 @@ class RabbitMQ:
         self.channel.start_consuming()
 
     def publish(self, queue_name, message):
+        """Publish synchronously and wait for the broker's confirm"""
         if not self.channel:
             raise Exception("Connection is not established.")
-        self.channel.queue_declare(queue=queue_name, durable=True)
+        if queue_name not in self._declared:
+            self.channel.queue_declare(queue=queue_name, durable=self.durable)
+            self._declared.add(queue_name)
         self.channel.basic_publish(exchange='',
                                    routing_key=queue_name,
                                    body=message,
                                    properties=pika.BasicProperties(
                                        delivery_mode=2,  # make message persistent
                                    ))
-        print(f"Sent message to queue {queue_name}: {message}")
\ No newline at end of file
+
+    def enqueue(self, queue_name, message):
+        """Hand a message to the publisher loop without blocking, False if it was rejected"""
+        try:
+            self._pending.put_nowait((queue_name, message, time.monotonic()))
+            return True
+        except queue.Full:
+            self._stats['rejected'] += 1
+            logger.error(f"Publisher backlog full, dropping message for queue {queue_name}")
+            return False
+
+    def run(self, reconnect_delay=1, max_reconnect_delay=30):
+        """Publisher loop, meant to run in its own background task"""
+        self._running = True
+        delay = reconnect_delay
+        while self._running:
+            try:
+                if self.connection is None or self.connection.is_closed:
+                    self.connect()
+                    print(f"{datetime.now()} - Connected publisher to RabbitMQ")
+                    delay = reconnect_delay
+
+                while self._spool:
+                    self._send(*self._spool[0])
+                    self._spool.popleft()
+
+                try:
+                    item = self._pending.get(timeout=1)
+                except queue.Empty:
+                    # Keep heartbeats flowing on an idle connection
+                    self.connection.process_data_events(0)
+                    continue
+
+                try:
+                    self._send(*item)
+                except Exception:
+                    self._spool.append(item)
+                    raise
+
+            except Exception as e:
+                self._stats['publish_failures'] += 1
+                self._stats['reconnects'] += 1
+                logger.error(f"RabbitMQ publisher error, retrying in {delay}s: {str(e)}")
+                self._disconnect()
+                time.sleep(delay)
+                delay = min(delay * 2, max_reconnect_delay)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['pending'] = self._pending.qsize()
+        stats['spooled'] = len(self._spool)
+        stats['connected'] = self.connection is not None and not self.connection.is_closed
+        return stats
+
+    def _send(self, queue_name, message, enqueued_at):
+        self.publish(queue_name, message)
+        self._stats['published'] += 1
+        self._stats['last_latency_ms'] = round((time.monotonic() - enqueued_at) * 1000, 2)
+
+    def _disconnect(self):
+        """Close the connection before dropping it, a publish error can leave it open"""
+        connection, self.connection, self.channel = self.connection, None, None
+        if connection is None:
+            return
+        try:
+            if not connection.is_closed:
+                connection.close()
+        except Exception as e:
+            logger.error(f"Error closing RabbitMQ connection: {str(e)}")
+
+    def _save_spool(self):
+        if not self.spool_path or not self._spool:
+            return
+        with open(self.spool_path, 'w') as spool_file:
+            for queue_name, message, _ in self._spool:
+                spool_file.write(json.dumps({'queue': queue_name, 'body': message.decode('utf-8')}) + "\n")
+        print(f"{datetime.now()} - Saved {len(self._spool)} unpublished messages to {self.spool_path}")
+
+    def _load_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path) as spool_file:
+            for line in spool_file:
+                entry = json.loads(line)
+                self._spool.append((entry['queue'], entry['body'].encode('utf-8'), time.monotonic()))
+        os.remove(self.spool_path)
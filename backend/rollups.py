@@ -0,0 +1,248 @@
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+from ml.app import HydrateDetector
+
+# (name, bucket width in seconds), finest first
+ROLLUP_LEVELS = [
+    ('1m', 60),
+    ('15m', 900),
+    ('1h', 3600),
+]
+
+SERIES = [
+    ('volume', 'gas_meter_volume_instant'),
+    ('setpoint', 'gas_meter_volume_setpoint'),
+    ('valve', 'gas_valve_percent_open'),
+]
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def table_name(level):
+    return f"gas_meter_rollup_{level}"
+
+
+def is_hydrate_sample(volume, valve):
+    """
+    Whether a stored row counts towards `hydrate_samples`. Live ingest and
+    `backfill` (in SQL) both use this definition, so a bucket holds the same
+    count whichever path wrote it. Missing or NaN readings never count.
+    """
+    return (
+        volume is not None and valve is not None
+        and volume < HydrateDetector.VOLUME_THRESHOLD and valve > HydrateDetector.VALVE_THRESHOLD
+    )
+
+
+def bucket_start(timestamp, seconds):
+    timestamp = timestamp.replace(microsecond=0)
+    return timestamp - timedelta(seconds=int((timestamp - EPOCH).total_seconds()) % seconds)
+
+
+def create_rollup_tables(cur):
+    for level, _ in ROLLUP_LEVELS:
+        series_columns = ",\n".join(
+            f"""
+                {name}_min FLOAT,
+                {name}_max FLOAT,
+                {name}_sum FLOAT NOT NULL DEFAULT 0,
+                {name}_count INTEGER NOT NULL DEFAULT 0"""
+            for name, _ in SERIES
+        )
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name(level)} (
+                device_id VARCHAR(255) NOT NULL,
+                user_email VARCHAR(255) NOT NULL,
+                bucket_start TIMESTAMP NOT NULL,
+                sample_count INTEGER NOT NULL,
+                hydrate_samples INTEGER NOT NULL DEFAULT 0,
+                {series_columns},
+                PRIMARY KEY (device_id, user_email, bucket_start)
+            )
+        ''')
+
+
+def _columns():
+    columns = ['device_id', 'user_email', 'bucket_start', 'sample_count', 'hydrate_samples']
+    for name, _ in SERIES:
+        columns += [f'{name}_min', f'{name}_max', f'{name}_sum', f'{name}_count']
+    return columns
+
+
+def _merge_assignments():
+    """Combine an existing bucket with newly ingested samples"""
+    assignments = [
+        'sample_count = r.sample_count + EXCLUDED.sample_count',
+        'hydrate_samples = r.hydrate_samples + EXCLUDED.hydrate_samples',
+    ]
+    for name, _ in SERIES:
+        # LEAST/GREATEST skip NULLs, so buckets without a reading do not erase the other side
+        assignments += [
+            f'{name}_min = LEAST(r.{name}_min, EXCLUDED.{name}_min)',
+            f'{name}_max = GREATEST(r.{name}_max, EXCLUDED.{name}_max)',
+            f'{name}_sum = r.{name}_sum + EXCLUDED.{name}_sum',
+            f'{name}_count = r.{name}_count + EXCLUDED.{name}_count',
+        ]
+    return ",\n".join(assignments)
+
+
+def aggregate(rows, seconds):
+    """
+    Fold ingested rows into per-bucket aggregates.
+
+    Args:
+        rows: Tuples of (device_id, user_email, timestamp, volume, setpoint, valve)
+        seconds: Bucket width
+
+    Returns:
+        list: Tuples matching the rollup table columns
+    """
+    buckets = {}
+    for device_id, user_email, timestamp, volume, setpoint, valve in rows:
+        key = (device_id, user_email, bucket_start(timestamp, seconds))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [0, 0] + [None, None, 0.0, 0] * len(SERIES)
+        bucket[0] += 1
+        bucket[1] += 1 if is_hydrate_sample(volume, valve) else 0
+        for i, value in enumerate((volume, setpoint, valve)):
+            if value is None or math.isnan(value):
+                continue
+            offset = 2 + i * 4
+            bucket[offset] = value if bucket[offset] is None else min(bucket[offset], value)
+            bucket[offset + 1] = value if bucket[offset + 1] is None else max(bucket[offset + 1], value)
+            bucket[offset + 2] += value
+            bucket[offset + 3] += 1
+    return [key + tuple(values) for key, values in buckets.items()]
+
+
+def apply_rows(cur, rows):
+    """Add freshly ingested rows to every rollup level, in the caller's transaction"""
+    columns = ", ".join(_columns())
+    for level, seconds in ROLLUP_LEVELS:
+        execute_values(cur, f"""
+            INSERT INTO {table_name(level)} AS r ({columns})
+            VALUES %s
+            ON CONFLICT (device_id, user_email, bucket_start) DO UPDATE SET
+            {_merge_assignments()}
+        """, aggregate(rows, seconds))
+
+
+def backfill(cur, since=None):
+    """
+    Rebuild rollups from raw rows, e.g. for data ingested before the rollup
+    tables existed. Buckets in range are replaced rather than merged, so each
+    level starts at the bucket holding `since` and rebuilds it whole.
+    """
+    for level, seconds in ROLLUP_LEVELS:
+        level_since = bucket_start(since, seconds) if since is not None else None
+        series_select = ",\n".join(
+            f"""
+                MIN({column}) FILTER (WHERE {column} <> 'NaN'),
+                MAX({column}) FILTER (WHERE {column} <> 'NaN'),
+                COALESCE(SUM({column}) FILTER (WHERE {column} <> 'NaN'), 0),
+                COUNT({column}) FILTER (WHERE {column} <> 'NaN')"""
+            for _, column in SERIES
+        )
+        replace = ",\n".join(f"{column} = EXCLUDED.{column}" for column in _columns()[3:])
+        cur.execute(f"""
+            INSERT INTO {table_name(level)} ({", ".join(_columns())})
+            SELECT
+                device_id,
+                user_email,
+                to_timestamp(floor(extract(epoch FROM timestamp) / {seconds}) * {seconds}) AT TIME ZONE 'UTC',
+                COUNT(*),
+                -- is_hydrate_sample, NaN sorts above every number in Postgres
+                COUNT(*) FILTER (WHERE gas_meter_volume_instant < {HydrateDetector.VOLUME_THRESHOLD}
+                                 AND gas_valve_percent_open > {HydrateDetector.VALVE_THRESHOLD}
+                                 AND gas_valve_percent_open <> 'NaN'),
+                {series_select}
+            FROM gas_meter_data
+            WHERE %s IS NULL OR timestamp >= %s
+            GROUP BY 1, 2, 3
+            ON CONFLICT (device_id, user_email, bucket_start) DO UPDATE SET
+            {replace}
+        """, (level_since, level_since))
+
+
+def prune(cur, before):
+    """Delete buckets starting before `before`, in the caller's transaction"""
+    for level, _ in ROLLUP_LEVELS:
+        cur.execute(f"DELETE FROM {table_name(level)} WHERE bucket_start < %s", (before,))
+
+
+def choose_level(start, end, max_points):
+    """Finest rollup level that covers [start, end] in at most `max_points` buckets"""
+    span = (end - start).total_seconds()
+    for level, seconds in ROLLUP_LEVELS:
+        if span / seconds <= max_points:
+            return level
+    return ROLLUP_LEVELS[-1][0]
+
+
+def fetch(cur, level, device_id, user_email, start, end, limit):
+    """At most `limit` buckets from `start` on"""
+    cur.execute(f"""
+        SELECT *
+        FROM {table_name(level)}
+        WHERE device_id = %s
+        AND user_email = %s
+        AND bucket_start >= %s
+        AND bucket_start <= %s
+        ORDER BY bucket_start ASC
+        LIMIT %s
+    """, (device_id, user_email, start, end, limit))
+    return cur.fetchall()
+
+
+def rollup_columns(rows):
+    """Per-bucket averages and extremes, with hydrate markers on state changes"""
+    columns = {'timestamp': [row['bucket_start'] for row in rows]}
+    for name, column in SERIES:
+        columns[column] = [row[f'{name}_sum'] / row[f'{name}_count'] if row[f'{name}_count'] else None for row in rows]
+        columns[f'{column}_min'] = [row[f'{name}_min'] for row in rows]
+        columns[f'{column}_max'] = [row[f'{name}_max'] for row in rows]
+    columns['sample_count'] = [row['sample_count'] for row in rows]
+    columns['hydrate_samples'] = [row['hydrate_samples'] for row in rows]
+
+    markers = []
+    in_hydrate = False
+    for row in rows:
+        marker = None
+        if row['hydrate_samples'] and not in_hydrate:
+            marker = 'start'
+        elif not row['hydrate_samples'] and in_hydrate:
+            marker = 'end'
+        in_hydrate = bool(row['hydrate_samples'])
+        markers.append(marker)
+    columns['is_hydration'] = markers
+    return columns
+
+
+if __name__ == '__main__':
+    # python rollups.py backfill [ISO timestamp]
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("Usage: python rollups.py backfill [since]")
+        sys.exit(1)
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        database=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USERNAME'),
+        password=os.getenv('DB_PASSWORD')
+    )
+    cur = conn.cursor()
+    create_rollup_tables(cur)
+    backfill(cur, datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None)
+    conn.commit()
+    conn.close()
+    print("Rollups rebuilt successfully!")
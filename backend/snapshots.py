@@ -0,0 +1,116 @@
+import json
+import time
+from logging import getLogger
+
+from psycopg2.extras import execute_values
+
+logger = getLogger()
+
+
+def create_snapshot_table(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS detector_snapshots (
+            user_email VARCHAR(255) NOT NULL,
+            device_id VARCHAR(255) NOT NULL,
+            state JSONB NOT NULL,
+            last_timestamp TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_email, device_id)
+        )
+    ''')
+
+
+def save(cur, detectors):
+    """Upsert the state of (key, detector) pairs unless a newer one is stored, returns how many were passed"""
+    rows = []
+    for (user_email, device_id), detector in detectors:
+        last_timestamp = detector.last_tracked()
+        if last_timestamp is None:
+            continue
+        rows.append((user_email, device_id, json.dumps(detector.to_state()), last_timestamp))
+    if rows:
+        execute_values(cur, '''
+            INSERT INTO detector_snapshots (user_email, device_id, state, last_timestamp)
+            VALUES %s
+            ON CONFLICT (user_email, device_id) DO UPDATE
+            SET state = EXCLUDED.state, last_timestamp = EXCLUDED.last_timestamp, updated_at = NOW()
+            -- Another process may own the device by now, never go back in time
+            WHERE detector_snapshots.last_timestamp <= EXCLUDED.last_timestamp
+        ''', rows, template="(%s, %s, %s::jsonb, %s)")
+    return len(rows)
+
+
+def load(pool, factory, max_age, max_rows, user_email, device_id):
+    """
+    Rebuild the detector of one device from its snapshot, if it was taken
+    within `max_age` seconds, and (up to `max_rows` of) the rows stored
+    after it, which are replayed in one batch, so no alert is sent again for
+    an event that was already ongoing. Called the first time a device is
+    seen by this process, so only devices it actually serves are loaded.
+
+    Returns:
+        HydrateDetector: Restored detector, None without a recent snapshot
+    """
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT s.state, r.timestamps, r.volume, r.setpoint, r.valve
+            FROM detector_snapshots s
+            LEFT JOIN LATERAL (
+                SELECT array_agg(timestamp ORDER BY timestamp) AS timestamps,
+                       array_agg(gas_meter_volume_instant ORDER BY timestamp) AS volume,
+                       array_agg(gas_meter_volume_setpoint ORDER BY timestamp) AS setpoint,
+                       array_agg(gas_valve_percent_open ORDER BY timestamp) AS valve
+                FROM (
+                    SELECT timestamp, gas_meter_volume_instant, gas_meter_volume_setpoint, gas_valve_percent_open
+                    FROM gas_meter_data g
+                    WHERE g.device_id = s.device_id
+                    AND g.user_email = s.user_email
+                    AND g.timestamp > s.last_timestamp
+                    ORDER BY g.timestamp DESC
+                    LIMIT %s
+                ) recent
+            ) r ON TRUE
+            WHERE s.user_email = %s
+            AND s.device_id = %s
+            AND s.updated_at > NOW() - %s * INTERVAL '1 second'
+        ''', (max_rows, user_email, device_id, max_age))
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        pool.putconn(conn)
+    if row is None:
+        return None
+
+    detector = factory()
+    detector.load_state(row['state'])
+    if row['timestamps']:
+        detector.replay(row['timestamps'], row['volume'], row['setpoint'], row['valve'])
+    return detector
+
+
+def save_all(pool, registry, since=0):
+    """Snapshot every detector that was fed a point in this process after `since` (time.monotonic())"""
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        written = save(cur, registry.seen_since(since))
+        conn.commit()
+        cur.close()
+        return written
+    finally:
+        pool.putconn(conn)
+
+
+def run(pool, registry, interval):
+    """Background loop snapshotting the detectors that changed since the previous pass"""
+    since = 0
+    while True:
+        time.sleep(interval)
+        started = time.monotonic()
+        try:
+            save_all(pool, registry, since)
+            since = started
+        except Exception as e:
+            logger.error(f"Detector snapshot error: {str(e)}")
@@ -0,0 +1,39 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+# The backend runs from its own directory, modules import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def raw_readings():
+    """
+    Raw (timestamp, volume, setpoint, valve) readings of a well with what the
+    cleaner has to deal with: setpoint and valve gaps (short and long),
+    out of range and negative readings, volume spikes and a hydrate event
+    every 40 readings.
+    """
+    rng = np.random.default_rng(7)
+    start = datetime(2024, 10, 1)
+    readings = []
+    for i in range(400):
+        in_event = i % 40 >= 30
+        volume = 20.0 + rng.normal() if in_event else 400.0 + 10 * rng.normal()
+        valve = 95.0 + rng.random() if in_event else 30.0 + rng.random()
+        setpoint = None if i % 7 == 3 else 375.0
+        if i % 13 == 5:
+            valve = None
+        if 200 <= i < 210:
+            valve = None
+        if i % 29 == 11:
+            volume *= 10
+        if i % 31 == 17:
+            valve = 120.0
+        if i % 37 == 19:
+            volume = -1.0
+        readings.append((start + timedelta(minutes=i), volume, setpoint, valve))
+    return readings
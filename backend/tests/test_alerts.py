@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import alerts
+from alerts import AlertSuppressor
+
+START = datetime(2024, 10, 1)
+WELL = ('user@example.com', 'well-1')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock of the token buckets and idle eviction, advanced by hand"""
+    class Clock:
+        now = 1000.0
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(alerts.time, 'monotonic', lambda: clock.now)
+    return clock
+
+
+def at(minutes):
+    return START + timedelta(minutes=minutes)
+
+
+def test_hysteresis_rearms_only_once_clear_of_the_thresholds(clock):
+    suppressor = AlertSuppressor(debounce=0, volume_margin=10, valve_margin=5)
+    assert suppressor.allow(WELL, WELL[0], at(0)) == (True, 0)
+
+    # Back over the volume threshold, but within the margin
+    suppressor.observe(WELL, 55.0, 92.0)
+    assert suppressor.allow(WELL, WELL[0], at(1)) == (False, 1)
+
+    suppressor.observe(WELL, 65.0, 92.0)
+    assert suppressor.allow(WELL, WELL[0], at(2)) == (True, 1)
+
+    suppressor.observe(WELL, 20.0, 80.0)
+    assert suppressor.allow(WELL, WELL[0], at(3)) == (True, 0)
+
+
+def test_debounce_counts_data_time(clock):
+    suppressor = AlertSuppressor(debounce=900)
+    assert suppressor.allow(WELL, WELL[0], at(0)) == (True, 0)
+
+    suppressor.observe(WELL, 400.0, 30.0)
+    assert suppressor.allow(WELL, WELL[0], at(10)) == (False, 1)
+
+    suppressor.observe(WELL, 400.0, 30.0)
+    assert suppressor.allow(WELL, WELL[0], at(15)) == (True, 1)
+
+
+def test_token_bucket_limits_each_recipient(clock):
+    suppressor = AlertSuppressor(rate_per_minute=6, burst=2)
+    wells = [(WELL[0], f"well-{i}") for i in range(4)]
+    assert [suppressor.allow(well, WELL[0], at(0))[0] for well in wells[:3]] == [True, True, False]
+    # Another recipient has its own bucket
+    assert suppressor.allow(('other@example.com', 'well-1'), 'other@example.com', at(0)) == (True, 0)
+
+    clock.advance(10)
+    assert suppressor.allow(wells[3], WELL[0], at(0)) == (True, 0)
+    assert suppressor.stats()['suppressed_total'] == 1
+
+
+def test_idle_devices_and_full_buckets_are_dropped(clock):
+    suppressor = AlertSuppressor(rate_per_minute=6, burst=2, idle_timeout=60, max_devices=2)
+    assert suppressor.allow(WELL, WELL[0], at(0)) == (True, 0)
+    assert suppressor.allow(WELL, WELL[0], at(1)) == (False, 1)
+
+    # Forgetting the device re-arms it and resets its count
+    clock.advance(60)
+    assert suppressor.allow(WELL, WELL[0], at(2)) == (True, 0)
+    assert suppressor.stats()['devices'] == 1 and suppressor.stats()['recipients'] == 1
+
+    for i in range(3):
+        suppressor.allow(('other@example.com', f"well-{i}"), 'other@example.com', at(3))
+    assert suppressor.stats()['devices'] == 2
+
+    clock.advance(20)
+    suppressor.allow(WELL, WELL[0], at(4))
+    assert suppressor.stats()['recipients'] == 1
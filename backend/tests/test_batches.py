@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from batches import BatchStreams
+from ingest import IngestBuffer, KnownDevices
+from ml.app import HydrateDetector, StreamCleaner
+
+KEY = ('user@example.com', 'well-1')
+START = datetime(2024, 10, 1)
+
+
+class MemoryBuffer(IngestBuffer):
+    """IngestBuffer writing nowhere, rows with a setpoint of `bad` are rejected"""
+
+    bad = -1.0
+
+    def __init__(self):
+        super().__init__(None, KnownDevices(), flush_size=10000)
+
+    def _write(self, rows):
+        return [i for i, row in enumerate(rows) if row[4] == self.bad]
+
+
+@pytest.fixture
+def buffer():
+    return MemoryBuffer()
+
+
+@pytest.fixture
+def streams(buffer):
+    return BatchStreams(buffer)
+
+
+def readings(start, count, setpoint=375.0):
+    return [(START + timedelta(minutes=start + i), 400.0, setpoint, 30.0) for i in range(count)]
+
+
+def release(streams, buffer, detector, points):
+    tickets = buffer.add_many([(KEY[1], KEY[0], *point[:4]) for point in points])
+    streams.released(KEY, detector, tickets)
+
+
+def feed(streams, buffer, detector, session, seq, rows, flush=False):
+    """What the data_batch handler does under the well's lock"""
+    turn = streams.claim(KEY, session, seq, detector, detector.newest_reading())
+    if turn != 'next':
+        return turn
+    rows = rows[streams.unstored(KEY, [row[0] for row in rows]):]
+    streams.push(KEY, seq, detector, len(rows))
+    points = []
+    for row in rows:
+        points += detector.process_raw(*row)
+    if flush:
+        points += detector.flush_raw()
+    release(streams, buffer, detector, points)
+    return turn
+
+
+def ack(streams, buffer):
+    buffer.flush()
+    _, acked, rejected = streams.settle(KEY, timeout=0)
+    return acked, rejected
+
+
+def test_batch_is_acked_once_its_held_readings_are_stored(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    feed(streams, buffer, detector, 's', 0, readings(0, 5))
+    # The cleaner still holds the batch's last reading
+    assert ack(streams, buffer) == (-1, [])
+
+    feed(streams, buffer, detector, 's', 1, readings(5, 5))
+    assert ack(streams, buffer) == (0, [])
+
+    feed(streams, buffer, detector, 's', 2, readings(10, 5), flush=True)
+    assert ack(streams, buffer) == (2, [])
+
+
+def test_ack_waits_for_the_ingest_buffer(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    feed(streams, buffer, detector, 's', 0, readings(0, 5), flush=True)
+    assert streams.settle(KEY, timeout=0)[1] == -1
+    assert ack(streams, buffer) == (0, [])
+
+
+def test_duplicate_and_early_batches(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    assert feed(streams, buffer, detector, 's', 0, readings(0, 5)) == 'next'
+    assert feed(streams, buffer, detector, 's', 0, readings(0, 5)) == 'duplicate'
+    assert feed(streams, buffer, detector, 's', 2, readings(10, 5)) == 'early'
+    assert not streams.wait_turn(KEY, 's', 2, timeout=0.01)
+    assert feed(streams, buffer, detector, 's', 1, readings(5, 5)) == 'next'
+    assert streams.wait_turn(KEY, 's', 2, timeout=0)
+
+
+def test_batch_with_a_dropped_row_is_acked_as_rejected(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    feed(streams, buffer, detector, 's', 0, readings(0, 5))
+    feed(streams, buffer, detector, 's', 1, readings(5, 5, setpoint=MemoryBuffer.bad))
+    feed(streams, buffer, detector, 's', 2, readings(10, 5), flush=True)
+    assert ack(streams, buffer) == (2, [1])
+
+
+def test_readings_held_before_the_stream_are_not_charged_to_a_batch(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    # A plain `data` reading on a well without a stream, held by the cleaner
+    streams.push(KEY, None, detector, 1)
+    release(streams, buffer, detector, detector.process_raw(*readings(0, 1)[0]))
+    assert detector.cleaner.held() == 1
+
+    feed(streams, buffer, detector, 's', 0, readings(1, 1))
+    # Its own reading is the one held now
+    assert ack(streams, buffer) == (-1, [])
+
+    feed(streams, buffer, detector, 's', 1, readings(2, 1), flush=True)
+    assert ack(streams, buffer) == (1, [])
+
+
+def test_new_session_skips_rows_the_well_already_has(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    feed(streams, buffer, detector, 'first', 0, readings(0, 10))
+    received = buffer.stats()['rows_received']
+
+    # The client restarted and sends everything again, numbered from 0
+    feed(streams, buffer, detector, 'second', 0, readings(0, 12), flush=True)
+    # The reading the first session left held, then the two new ones
+    assert buffer.stats()['rows_received'] - received == 1 + 2
+    assert ack(streams, buffer) == (0, [])
+
+
+def test_replaced_session_is_not_acknowledged(streams, buffer):
+    detector = HydrateDetector(cleaner=StreamCleaner())
+    feed(streams, buffer, detector, 'first', 0, readings(0, 5))
+    feed(streams, buffer, detector, 'second', 0, readings(5, 5), flush=True)
+    stream, acked, _ = streams.settle(KEY, timeout=0)
+    assert stream.session == 'second' and acked == -1
+    assert ack(streams, buffer) == (0, [])
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from ml.app import StreamCleaner
+
+START = datetime(2024, 10, 1)
+
+
+def clean(readings, **settings):
+    """Push (volume, setpoint, valve) readings a minute apart, then flush"""
+    cleaner = StreamCleaner(**settings)
+    released = []
+    for i, (volume, setpoint, valve) in enumerate(readings):
+        released += cleaner.push(START + timedelta(minutes=i), volume, setpoint, valve)
+    return released + cleaner.flush()
+
+
+def test_setpoint_is_forward_filled():
+    points = clean([(100, 375, 50), (100, None, 50), (100, 380, 50)], spike_ratio=None)
+    assert [point[2] for point in points] == [375, 375, 380]
+
+
+def test_short_valve_gap_is_interpolated():
+    points = clean([(100, 375, 10), (100, 375, None), (100, 375, None), (100, 375, 40)], spike_ratio=None)
+    assert [point[3] for point in points] == pytest.approx([10, 20, 30, 40])
+
+
+def test_long_valve_gap_is_forward_filled():
+    readings = [(100, 375, 10)] + [(100, 375, None)] * 4 + [(100, 375, 40)]
+    points = clean(readings, lookahead=2, spike_ratio=None)
+    assert [point[3] for point in points] == [10, 10, 10, 10, 10, 40]
+
+
+def test_out_of_range_readings_count_as_missing():
+    points = clean([(100, 375, 10), (-5, 375, 120), (100, 375, 30)], spike_ratio=None)
+    assert points[1][1] != points[1][1]
+    assert points[1][3] == pytest.approx(20)
+
+
+def test_upward_spike_is_replaced_and_drop_kept():
+    points = clean([(100, 375, 50), (1000, 375, 50), (100, 375, 50), (5, 375, 50), (100, 375, 50)])
+    assert [point[1] for point in points] == [100, 100, 100, 5, 100]
+
+
+def test_points_come_out_in_push_order(raw_readings):
+    cleaner = StreamCleaner(lookahead=5)
+    released = []
+    for pushed, reading in enumerate(raw_readings, 1):
+        released += cleaner.push(*reading)
+        assert cleaner.held() == pushed - len(released) <= 6
+        if cleaner.held():
+            assert cleaner.newest() == reading[0]
+    released += cleaner.flush()
+
+    assert cleaner.held() == 0
+    assert [point[0] for point in released] == [reading[0] for reading in raw_readings]
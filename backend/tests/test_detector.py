@@ -0,0 +1,98 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ml.app import HydrateDetector, StreamCleaner
+
+# Upper bound for one well's detector, see the HydrateDetector docstring
+MAX_BYTES_PER_WELL = 8 * 1024
+
+
+def cleaned(raw_readings):
+    cleaner = StreamCleaner()
+    points = []
+    for reading in raw_readings:
+        points += cleaner.push(*reading)
+    return points + cleaner.flush()
+
+
+def columns(points):
+    return [point[0] for point in points], *(np.array([point[i] for point in points], dtype=float) for i in (1, 2, 3))
+
+
+def assert_same_state(detector, expected):
+    assert detector.timestamp_window == expected.timestamp_window
+    for name in ('volume_window', 'setpoint_window', 'valve_window'):
+        np.testing.assert_allclose(getattr(detector, name), getattr(expected, name), equal_nan=True)
+    assert (detector.current_event or {}).get('start_time') == (expected.current_event or {}).get('start_time')
+    metrics, expected_metrics = detector.rolling_metrics(), expected.rolling_metrics()
+    for name, value in expected_metrics.items():
+        assert metrics[name] == pytest.approx(value, rel=1e-6, abs=1e-9), name
+
+
+def test_memory_per_well(raw_readings):
+    wells = 200
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        detectors = []
+        for _ in range(wells):
+            detector = HydrateDetector(cleaner=StreamCleaner())
+            for reading in raw_readings[:200]:
+                detector.process_raw(*reading)
+            detectors.append(detector)
+        per_well = (tracemalloc.get_traced_memory()[0] - before) / wells
+    finally:
+        tracemalloc.stop()
+
+    assert len(detectors[0].detected_events) == 4
+    assert per_well < MAX_BYTES_PER_WELL
+
+
+@pytest.mark.parametrize('chunks', [1, 3])
+def test_detect_batch_matches_streaming(raw_readings, chunks):
+    points = cleaned(raw_readings)
+
+    streaming = HydrateDetector()
+    statuses = []
+    for timestamp, volume, setpoint, valve in points:
+        streaming.track(timestamp, volume, setpoint, valve)
+        statuses.append(streaming.detect_hydrate_formation(volume, valve, timestamp)[1])
+
+    batch = HydrateDetector()
+    batch_statuses = []
+    events = []
+    for chunk in np.array_split(np.arange(len(points)), chunks):
+        result = batch.detect_batch(*columns([points[i] for i in chunk]))
+        batch_statuses += result['event_status'].tolist()
+        events += result['events']
+
+    assert batch_statuses == statuses
+    assert len(events) == sum(status == "Hydrate event ended" for status in statuses)
+    # Both keep the last max_events completed events
+    assert [(event['start_time'], event['end_time']) for event in batch.detected_events] == [
+        (event['start_time'], event['end_time']) for event in streaming.detected_events
+    ]
+    assert_same_state(batch, streaming)
+
+
+def test_snapshot_restore_and_replay_matches_live_detector(raw_readings):
+    live = HydrateDetector(cleaner=StreamCleaner())
+    stored = []
+    for i, reading in enumerate(raw_readings):
+        if i == 150:
+            # What snapshots.save writes, taken while the cleaner holds readings back
+            state = json.loads(json.dumps(live.to_state()))
+            snapshot_time = live.last_tracked()
+        stored += [point[:4] for point in live.process_raw(*reading)]
+
+    # What snapshots.restore does with the rows stored after the snapshot
+    restored = HydrateDetector(cleaner=StreamCleaner())
+    restored.load_state(state)
+    restored.replay(*columns([point for point in stored if point[0] > snapshot_time]))
+
+    assert_same_state(restored, live)
+    assert restored.cleaner.last_setpoint == live.cleaner.last_setpoint
+    assert restored.cleaner.last_valve == live.cleaner.last_valve
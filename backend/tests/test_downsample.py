@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from downsample import downsample_indices, lttb_indices, minmax_indices
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(3)
+    x = np.arange(5000, dtype=float) * 60
+    y = 400 + 10 * rng.normal(size=len(x))
+    y[1234] = 5000.0  # spike
+    y[3456] = -500.0  # drop
+    y[2000:2010] = np.nan
+    return x, y
+
+
+@pytest.mark.parametrize('max_points', [3, 10, 500, 4999])
+def test_lttb_keeps_endpoints_within_budget(series, max_points):
+    x, y = series
+    indices = lttb_indices(x, y, max_points)
+    assert len(indices) == max_points
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_keeps_extremes(series):
+    x, y = series
+    indices = lttb_indices(x, y, 500)
+    assert 1234 in indices and 3456 in indices
+
+
+def test_lttb_returns_short_series_whole(series):
+    x, y = series
+    assert np.array_equal(lttb_indices(x[:50], y[:50], 100), np.arange(50))
+
+
+def test_minmax_keeps_endpoints_and_extremes_of_each_bucket(series):
+    x, y = series
+    bucket = 3600
+    indices = minmax_indices(x, y, bucket)
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert len(indices) <= 3 * int(np.ceil((x[-1] - x[0] + 1) / bucket)) + 1
+    assert 1234 in indices and 3456 in indices
+
+
+def test_downsample_keeps_marked_rows(series):
+    x, y = series
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[17, 2500, 4001]] = True
+    indices = downsample_indices(x, y, keep, max_points=200, bucket=600)
+    assert len(indices) <= 200 + 3
+    assert {0, len(x) - 1, 17, 2500, 4001} <= set(indices.tolist())
+    assert np.all(np.diff(indices) > 0)
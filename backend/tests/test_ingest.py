@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+
+import ingest
+from ingest import IngestBuffer, IngestBufferFull, KnownDevices
+
+START = datetime(2024, 10, 1)
+
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Inserts into gas_meter_data fail for rows with a setpoint in `database.bad`"""
+    class Database:
+        bad = set()
+        inserted = []
+        unavailable = 0
+
+    def execute_values(cur, query, rows, **kwargs):
+        if 'gas_meter_data' not in query:
+            return
+        if Database.unavailable:
+            Database.unavailable -= 1
+            raise psycopg2.OperationalError("server closed the connection")
+        if any(row[4] in Database.bad for row in rows):
+            raise psycopg2.IntegrityError("violates foreign key constraint")
+        Database.inserted += rows
+
+    monkeypatch.setattr(ingest, 'execute_values', execute_values)
+    monkeypatch.setattr(ingest.rollups, 'apply_rows', lambda cur, rows: None)
+    return Database
+
+
+def row(i, setpoint=375.0):
+    return ('well-1', 'user@example.com', START + timedelta(minutes=i), 400.0, setpoint, 30.0)
+
+
+def test_bisection_drops_only_rejected_rows(database):
+    database.bad = {3.0, 7.0, 8.0}
+    buffer = IngestBuffer(FakePool(), KnownDevices())
+    tickets = buffer.add_many([row(i, setpoint=float(i)) for i in range(10)])
+
+    assert buffer.flush() == 7
+    assert [stored[4] for stored in database.inserted] == [0.0, 1.0, 2.0, 4.0, 5.0, 6.0, 9.0]
+    stats = buffer.stats()
+    assert stats['rows_flushed'] == 7 and stats['rows_dropped'] == 3
+
+    assert buffer.dropped([(tickets[3], tickets[3])])
+    assert buffer.dropped([(tickets[6], tickets[8])])
+    assert not buffer.dropped([(tickets[0], tickets[2]), (tickets[9], tickets[9])])
+    assert not buffer.dropped([(tickets[4], tickets[6] - 1)])
+
+
+def test_tickets_settle_in_order(database):
+    buffer = IngestBuffer(FakePool(), KnownDevices())
+    first = buffer.add_many([row(0), row(1)])
+    assert first == [1, 2]
+    assert not buffer.wait(first[-1], timeout=0)
+
+    buffer.flush()
+    second = buffer.add_many([row(2)])
+    assert second == [3]
+    assert buffer.wait(first[-1], timeout=0)
+    assert not buffer.wait(second[0], timeout=0)
+
+
+def test_connection_errors_keep_rows_for_the_next_flush(database):
+    database.unavailable = 1
+    buffer = IngestBuffer(FakePool(), KnownDevices())
+    tickets = buffer.add_many([row(0), row(1)])
+
+    assert buffer.flush() == 0
+    assert buffer.stats()['rows_pending'] == 2
+    assert not buffer.wait(tickets[-1], timeout=0)
+
+    assert buffer.flush() == 2
+    assert buffer.wait(tickets[-1], timeout=0)
+    assert not buffer.dropped([(tickets[0], tickets[-1])])
+
+
+def test_reserve_holds_room_until_the_block_ends(database):
+    buffer = IngestBuffer(FakePool(), KnownDevices(), max_rows=4, block_timeout=0.01)
+    with buffer.reserve(3):
+        buffer.add_many([row(0)])
+        with pytest.raises(IngestBufferFull):
+            with buffer.reserve(1):
+                pass
+    assert buffer.stats()['rows_reserved'] == 0
+    with buffer.reserve(3):
+        pass
+
+    buffer.flush()
+    with buffer.reserve(4):
+        assert buffer.stats()['rows_reserved'] == 4
+
+
+def test_invalid_rows_are_refused_before_queueing():
+    buffer = IngestBuffer(FakePool(), KnownDevices())
+    with pytest.raises(ValueError):
+        buffer.add_many([row(0), ('well-1', 'user@example.com', '2024-10-01', 400.0, 375.0, 30.0)])
+    with pytest.raises(ValueError):
+        buffer.add_many([('x' * 256, 'user@example.com', START, 400.0, 375.0, 30.0)])
+    assert buffer.stats()['rows_received'] == 0
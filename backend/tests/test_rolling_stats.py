@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from ml.app import RollingStats
+
+
+def test_rolling_stats_match_numpy():
+    rng = np.random.default_rng(3)
+    seconds = np.cumsum(rng.integers(1, 120, size=2000)).astype(float)
+    values = rng.normal(100, 25, size=2000)
+    values[rng.random(2000) < 0.1] = np.nan
+
+    window = 60
+    stats = RollingStats()
+    for i, (x, y) in enumerate(zip(seconds, values)):
+        if i >= window:
+            stats.remove(seconds[i - window], values[i - window])
+        stats.add(x, y)
+
+        in_window = slice(max(i - window + 1, 0), i + 1)
+        valid = ~np.isnan(values[in_window])
+        xs, ys = seconds[in_window][valid], values[in_window][valid]
+        assert stats.count == len(ys)
+        if len(ys) > 1:
+            assert stats.mean() == pytest.approx(ys.mean(), rel=1e-9)
+            assert stats.variance() == pytest.approx(ys.var(ddof=1), rel=1e-6)
+            assert stats.slope() == pytest.approx(np.polyfit(xs, ys, 1)[0], rel=1e-6, abs=1e-12)
@@ -0,0 +1,81 @@
+import json
+
+from detectors import DetectorRegistry
+from ml.app import HydrateDetector, StreamCleaner
+import snapshots
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, row):
+        self.cur = FakeCursor(row)
+
+    def cursor(self):
+        return self.cur
+
+
+class FakePool:
+    def __init__(self, row):
+        self.conn = FakeConnection(row)
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+
+def test_load_restores_snapshot_and_replays_later_rows(raw_readings):
+    live = HydrateDetector(cleaner=StreamCleaner())
+    stored = []
+    for reading in raw_readings[:100]:
+        stored += [point[:4] for point in live.process_raw(*reading)]
+    state = json.loads(json.dumps(live.to_state()))
+    later = []
+    for reading in raw_readings[100:150]:
+        later += [point[:4] for point in live.process_raw(*reading)]
+
+    pool = FakePool({
+        'state': state,
+        'timestamps': [point[0] for point in later],
+        'volume': [point[1] for point in later],
+        'setpoint': [point[2] for point in later],
+        'valve': [point[3] for point in later],
+    })
+    detector = snapshots.load(pool, HydrateDetector, 3600, 5000, 'user@example.com', 'well-1')
+
+    assert detector.last_tracked() == live.last_tracked()
+    assert detector.timestamp_window == live.timestamp_window
+    _, params = pool.conn.cur.queries[0]
+    assert params == (5000, 'user@example.com', 'well-1', 3600)
+
+
+def test_load_without_recent_snapshot():
+    assert snapshots.load(FakePool(None), HydrateDetector, 3600, 5000, 'user@example.com', 'well-1') is None
+
+
+def test_registry_builds_missing_detectors_with_loader():
+    restored = HydrateDetector()
+    registry = DetectorRegistry()
+    registry.loader = lambda user_email, device_id: restored if device_id == 'known' else None
+
+    assert registry.get('user@example.com', 'known') is restored
+    fresh = registry.get('user@example.com', 'new')
+    assert fresh is not restored and isinstance(fresh, HydrateDetector)
+    # Live detectors are not loaded again
+    registry.loader = None
+    assert registry.get('user@example.com', 'known') is restored
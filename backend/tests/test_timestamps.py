@@ -0,0 +1,56 @@
+import math
+from datetime import datetime
+
+import pytest
+
+from timestamps import LEGACY_FORMAT, TimestampCodec, epoch_millis, epochs_to_datetimes, format_legacy
+
+KEY = ('user@example.com', 'well-1')
+TIMESTAMPS = [
+    datetime(2024, 10, 31, 0, 0, 0),
+    datetime(2024, 10, 31, 12, 5, 9),
+    datetime(2024, 11, 1, 23, 59, 59),
+    datetime(1969, 12, 31, 18, 30, 0),
+]
+
+
+@pytest.mark.parametrize('timestamp', TIMESTAMPS)
+def test_legacy_round_trip(timestamp):
+    text = format_legacy(timestamp)
+    assert text == timestamp.strftime(LEGACY_FORMAT)
+    assert TimestampCodec().parse(KEY, text) == timestamp
+
+
+def test_epoch_round_trip():
+    # Pre-1970 milliseconds this close to the epoch would be read as seconds
+    timestamps = TIMESTAMPS[:3]
+    codec = TimestampCodec()
+    millis = epoch_millis(timestamps)
+    assert codec.parse_many(KEY, millis) == timestamps
+    assert [codec.parse(KEY, value / 1000) for value in millis] == timestamps
+    assert epochs_to_datetimes([value / 1000 for value in millis]) == timestamps
+
+
+def test_iso_offsets_become_naive_utc():
+    codec = TimestampCodec()
+    assert codec.parse(KEY, '2024-10-31T14:05:09+02:00') == datetime(2024, 10, 31, 12, 5, 9)
+    assert codec.parse(KEY, '2024-10-31T12:05:09Z') == datetime(2024, 10, 31, 12, 5, 9)
+
+
+def test_device_changing_format_is_detected_again():
+    codec = TimestampCodec()
+    assert codec.parse(KEY, '10/31/2024 12:05:09 PM') == datetime(2024, 10, 31, 12, 5, 9)
+    assert codec.parse(KEY, '2024-10-31T12:05:10') == datetime(2024, 10, 31, 12, 5, 10)
+    assert codec.stats()['detections'] == 2
+
+
+@pytest.mark.parametrize('value', [math.nan, math.inf, -math.inf, 1e20, 'nan', 'inf', '13/45/2024 10:00:00 AM', None])
+def test_invalid_timestamps_are_rejected(value):
+    with pytest.raises(ValueError):
+        TimestampCodec().parse(KEY, value)
+
+
+@pytest.mark.parametrize('value', [math.nan, math.inf, 1e20])
+def test_invalid_epoch_in_a_batch_rejects_it(value):
+    with pytest.raises(ValueError, match='position 1'):
+        TimestampCodec().parse_many(KEY, [1730332800, value, 1730332860])
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+LEGACY_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+EPOCH = datetime(1970, 1, 1)
+# Epoch numbers above this are taken as milliseconds (year 5138 in seconds)
+EPOCH_MILLIS_THRESHOLD = 1e11
+# Seconds since EPOCH that datetime can represent
+EPOCH_MIN_SECONDS = (datetime.min - EPOCH).total_seconds()
+EPOCH_MAX_SECONDS = (datetime.max - EPOCH).total_seconds()
+
+
+def parse_legacy(value):
+    """Hand-rolled '%m/%d/%Y %I:%M:%S %p' parser, several times faster than strptime"""
+    date, clock, meridiem = value.split(' ')
+    month, day, year = date.split('/')
+    hour, minute, second = clock.split(':')
+    hour = int(hour)
+    if not 1 <= hour <= 12:
+        raise ValueError(f"hour {hour} is out of range for a 12-hour clock")
+    meridiem = meridiem.upper()
+    if meridiem == 'AM':
+        hour %= 12
+    elif meridiem == 'PM':
+        hour = hour % 12 + 12
+    else:
+        raise ValueError(f"unknown meridiem {meridiem}")
+    return datetime(int(year), int(month), int(day), hour, int(minute), int(second))
+
+
+def parse_legacy_24h(value):
+    """'%m/%d/%Y %H:%M:%S'"""
+    date, clock = value.split(' ')
+    month, day, year = date.split('/')
+    hour, minute, second = clock.split(':')
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+
+
+def parse_iso(value):
+    """ISO-8601, offsets are converted to naive UTC like the rest of the table"""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_epoch(value):
+    """Epoch seconds or milliseconds, as a number or a numeric string, to naive UTC"""
+    seconds = float(value)
+    if abs(seconds) >= EPOCH_MILLIS_THRESHOLD:
+        seconds /= 1000
+    # NaN fails the comparison too
+    if not EPOCH_MIN_SECONDS <= seconds <= EPOCH_MAX_SECONDS:
+        raise ValueError(f"Epoch {value!r} is not a representable time")
+    return EPOCH + timedelta(seconds=seconds)
+
+
+# Tried in order when a device's format is not known yet
+STRING_PARSERS = (parse_legacy, parse_iso, parse_legacy_24h, parse_epoch)
+
+
+def detect(value):
+    """
+    Find the parser for a wire timestamp.
+
+    Returns:
+        tuple: (parser, datetime)
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return parse_epoch, parse_epoch(value)
+    if not isinstance(value, str):
+        raise ValueError(f"Unsupported timestamp {value!r}")
+    for parser in STRING_PARSERS:
+        try:
+            return parser, parser(value)
+        except (ValueError, OverflowError):
+            continue
+    raise ValueError(f"Unrecognized timestamp {value!r}")
+
+
+class TimestampCodec:
+    """
+    Parses wire timestamps (epoch seconds/milliseconds, ISO-8601 or the legacy
+    CSV format) and remembers which format each device sends, so the steady
+    state is a single direct parse per row with no exception-driven fallback.
+
+    Args:
+        max_devices: Devices whose format is remembered before the cache is reset
+    """
+
+    def __init__(self, max_devices=10000):
+        self.max_devices = max_devices
+        self._parsers = {}
+        self._stats = {'parsed': 0, 'detections': 0}
+
+    def parse(self, device_key, value):
+        self._stats['parsed'] += 1
+        parser = self._parsers.get(device_key)
+        if parser is not None:
+            try:
+                return parser(value)
+            except (ValueError, TypeError, AttributeError, OverflowError):
+                pass
+        parser, timestamp = detect(value)
+        self._remember(device_key, parser)
+        return timestamp
+
+    def parse_many(self, device_key, values):
+        """Parse a batch, numeric epochs are converted in one vectorized step"""
+        if not values:
+            return []
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            self._stats['parsed'] += len(values)
+            self._remember(device_key, parse_epoch)
+            return epochs_to_datetimes(values)
+        return [self.parse(device_key, value) for value in values]
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['devices'] = len(self._parsers)
+        return stats
+
+    def _remember(self, device_key, parser):
+        if self._parsers.get(device_key) is parser:
+            return
+        if len(self._parsers) >= self.max_devices:
+            self._parsers.clear()
+        self._parsers[device_key] = parser
+        self._stats['detections'] += 1
+
+
+def epochs_to_datetimes(values):
+    """
+    Epoch seconds or milliseconds (decided per value) to naive UTC datetimes.
+    Raises ValueError if any value is NaN, infinite or out of range, before
+    converting any of them.
+    """
+    seconds = np.asarray(values, dtype=float)
+    seconds = np.where(np.abs(seconds) >= EPOCH_MILLIS_THRESHOLD, seconds / 1000, seconds)
+    # NaN fails both comparisons
+    invalid = ~((seconds >= EPOCH_MIN_SECONDS) & (seconds <= EPOCH_MAX_SECONDS))
+    if invalid.any():
+        index = int(np.argmax(invalid))
+        raise ValueError(f"Epoch {values[index]!r} at position {index} is not a representable time")
+    return (seconds * 1e6).astype('datetime64[us]').astype(object).tolist()
+
+
+def epoch_millis(timestamps):
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64).tolist()
+
+
+def format_legacy(timestamp):
+    """Same output as strftime(LEGACY_FORMAT) without going through strftime"""
+    hour = timestamp.hour
+    return (
+        f"{timestamp.month:02d}/{timestamp.day:02d}/{timestamp.year:04d} "
+        f"{hour % 12 or 12:02d}:{timestamp.minute:02d}:{timestamp.second:02d} {'PM' if hour >= 12 else 'AM'}"
+    )
+
+
+def format_legacy_many(timestamps):
+    return [format_legacy(timestamp) for timestamp in timestamps]
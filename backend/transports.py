@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from rabbitmq_worker import RabbitMQ
+
+
+class InMemoryBroker:
+    """
+    Drop-in stand-in for the RabbitMQ publisher that keeps published messages
+    in process, for load tests and local runs without a broker. The last
+    `max_messages` messages are kept along with the wall-clock time they were
+    published.
+    """
+
+    def __init__(self, max_messages=10000):
+        self._messages = deque(maxlen=max_messages)
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def enqueue(self, queue_name, message):
+        with self._lock:
+            self._messages.append((queue_name, message, time.time()))
+            self._published += 1
+        return True
+
+    def run(self):
+        pass
+
+    def close(self):
+        pass
+
+    def recent(self, limit=100):
+        with self._lock:
+            messages = list(self._messages)[-limit:]
+        return [
+            {'queue': queue_name, 'message': json.loads(message), 'published_at': published_at}
+            for queue_name, message, published_at in messages
+        ]
+
+    def stats(self):
+        return {
+            'transport': 'memory',
+            'published': self._published,
+            'captured': len(self._messages),
+        }
+
+
+def create_publisher():
+    """Alert publisher selected by ALERT_TRANSPORT (rabbitmq or memory)"""
+    transport = os.getenv('ALERT_TRANSPORT', 'rabbitmq')
+    if transport == 'memory':
+        return InMemoryBroker(max_messages=int(os.getenv('ALERT_MEMORY_MAX_MESSAGES', 10000)))
+    if transport != 'rabbitmq':
+        raise ValueError(f"Unknown ALERT_TRANSPORT {transport}, expected rabbitmq or memory")
+    return RabbitMQ(
+        max_pending=int(os.getenv('RABBIT_MAX_PENDING', 10000)),
+        spool_path=os.getenv('RABBIT_SPOOL_PATH') or None
+    )
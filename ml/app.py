@@ -1,39 +1,308 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from collections import deque
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
+import numpy as np
 
 app = Flask(__name__)
 CORS(app)
 
+class StreamCleaner:
+    """
+    Streaming counterpart of the client-side pandas cleaning, so devices can
+    send raw readings. Every point costs O(1) and at most `lookahead` + 1
+    points are held at any time.
+
+    - Setpoint is forward-filled.
+    - Valve gaps of up to `lookahead` points are linearly interpolated once
+      the next valid reading arrives, longer gaps are forward-filled.
+      Readings outside 0-100 count as missing.
+    - An isolated upward volume spike (above `spike_ratio` times both
+      neighbours plus `spike_floor`) is replaced by the neighbours' mean.
+      This needs the next point, so every point is held back by one reading.
+      Drops are left alone since that is what a hydrate looks like.
+      `spike_ratio=None` disables the check and the delay.
+
+    Args:
+        lookahead: Longest valve gap that is interpolated
+        spike_ratio: Ratio to both neighbours above which a volume is a spike
+        spike_floor: Absolute margin added to the spike threshold
+    """
+    __slots__ = (
+        'lookahead', 'spike_ratio', 'spike_floor', 'last_setpoint', 'last_valve', 'long_gap',
+        '_held', '_previous_volume', '_pending'
+    )
+
+    def __init__(self, lookahead=5, spike_ratio=3.0, spike_floor=50.0):
+        self.lookahead = lookahead
+        self.spike_ratio = spike_ratio
+        self.spike_floor = spike_floor
+
+        self.last_setpoint = np.nan
+        self.last_valve = np.nan
+        self.long_gap = False
+        self._held = None
+        self._previous_volume = np.nan
+        self._pending = deque()
+
+    def push(self, timestamp, volume, setpoint, valve):
+        """Feed one raw reading, returns the cleaned [timestamp, volume, setpoint, valve] points it releases"""
+        volume = self._reading(volume)
+        if volume < 0:
+            volume = np.nan
+        valve = self._reading(valve)
+        if not 0 <= valve <= 100:
+            valve = np.nan
+        point = [timestamp, volume, self._reading(setpoint), valve]
+
+        released = []
+        if self.spike_ratio is None:
+            self._resolve(point, released)
+            return released
+
+        held, self._held = self._held, point
+        if held is not None:
+            raw_volume = held[1]
+            if self.is_spike(self._previous_volume, raw_volume, volume):
+                held[1] = (self._previous_volume + volume) / 2
+            self._previous_volume = raw_volume
+            self._resolve(held, released)
+        return released
+
+    def flush(self):
+        """Release every held point, e.g. when a device goes quiet"""
+        released = []
+        if self._held is not None:
+            self._previous_volume = self._held[1]
+            self._resolve(self._held, released)
+            self._held = None
+        self._release_pending(self.last_valve, released)
+        return released
+
+    def held(self):
+        """Number of pushed readings not released yet, they come out in push order"""
+        return (self._held is not None) + len(self._pending)
+
+    def newest(self):
+        """Timestamp of the newest reading still held, None when nothing is"""
+        if self._held is not None:
+            return self._held[0]
+        return self._pending[-1][0] if self._pending else None
+
+    def is_spike(self, previous, volume, following):
+        # NaN comparisons are False, so a missing neighbour never makes a spike
+        return volume > self.spike_ratio * max(previous, following) + self.spike_floor and previous == previous and following == following
+
+    def _resolve(self, point, released):
+        if point[2] == point[2]:
+            self.last_setpoint = point[2]
+        else:
+            point[2] = self.last_setpoint
+
+        valve = point[3]
+        if valve == valve:
+            # Interpolate the gap between the last valid valve and this one
+            gap = len(self._pending)
+            for k, pending in enumerate(self._pending, 1):
+                pending[3] = self.last_valve + (valve - self.last_valve) * k / (gap + 1)
+            released.extend(self._pending)
+            self._pending.clear()
+            self.last_valve = valve
+            self.long_gap = False
+            released.append(point)
+        elif self.long_gap or self.last_valve != self.last_valve:
+            point[3] = self.last_valve
+            released.append(point)
+        elif len(self._pending) >= self.lookahead:
+            # Too long to wait for, forward-fill the whole gap
+            self._release_pending(self.last_valve, released)
+            point[3] = self.last_valve
+            released.append(point)
+            self.long_gap = True
+        else:
+            self._pending.append(point)
+
+    def _release_pending(self, valve, released):
+        for pending in self._pending:
+            pending[3] = valve
+        released.extend(self._pending)
+        self._pending.clear()
+
+    @staticmethod
+    def _reading(value):
+        return np.nan if value is None else float(value)
+
+
+class RollingStats:
+    """
+    Mean, variance and least-squares slope over a sliding window, updated in
+    O(1) per sample with Welford-style add/remove steps instead of
+    recomputing over the window. Samples are (seconds, value) pairs, the
+    window itself is owned by the caller, which removes the sample falling
+    out of it. NaN values are ignored.
+    """
+    __slots__ = ('count', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def mean(self):
+        return self.mean_y if self.count else None
+
+    def variance(self):
+        """Sample variance of the values"""
+        return max(self.m2_y, 0.0) / (self.count - 1) if self.count > 1 else None
+
+    def slope(self):
+        """Change of the value per second, None until two distinct times are in the window"""
+        return self.c_xy / self.m2_x if self.count > 1 and self.m2_x > 0 else None
+
+    def add(self, x, y):
+        if y != y:
+            return
+        self.count += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.count
+        self.mean_y += dy / self.count
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+
+    def remove(self, x, y):
+        if y != y:
+            return
+        if self.count == 1:
+            self.reset()
+            return
+        old_mean_x, old_mean_y = self.mean_x, self.mean_y
+        self.count -= 1
+        self.mean_x -= (x - old_mean_x) / self.count
+        self.mean_y -= (y - old_mean_y) / self.count
+        self.m2_x -= (x - self.mean_x) * (x - old_mean_x)
+        self.m2_y -= (y - self.mean_y) * (y - old_mean_y)
+        self.c_xy -= (x - self.mean_x) * (y - old_mean_y)
+
+
+class DetectionResult:
+    """
+    Result of `process_data_point`. One instance per detector is updated in
+    place instead of building a new dict per point, it still reads like the
+    dict it replaces (`result["is_hydrate"]`) and `to_dict()` gives a copy
+    for JSON.
+    """
+    __slots__ = ('is_hydrate', 'event_status', 'current_metrics', 'current_event', 'events')
+    KEYS = ('is_hydrate', 'event_status', 'current_metrics', 'current_event', 'recent_events')
+
+    def __init__(self, events):
+        self.is_hydrate = False
+        self.event_status = None
+        self.current_metrics = None
+        self.current_event = None
+        self.events = events
+
+    @property
+    def recent_events(self):
+        """Last 5 events"""
+        return list(self.events)[-5:]
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def keys(self):
+        return self.KEYS
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+
 class HydrateDetector:
-    def __init__(self, window_size=60):  # Keep last 60 points for analysis
+    """
+    Hydrate detection state of one well.
+
+    The last `window_size` points live in a single (window_size, 4) float64
+    ring buffer of seconds since `time_origin`, volume, setpoint and valve,
+    with rolling statistics kept alongside. Only the last `max_events`
+    completed events are kept and `process_data_point` updates one reusable
+    DetectionResult. With the default window of 60 and the cleaner, a well
+    takes about 6.4 KB once its window is full: tracemalloc over detectors
+    fed 200 raw readings each through `process_raw` (4 completed events
+    apiece), as in backend/tests/test_detector.py which keeps it under 8 KB,
+    against 30 KB for the previous deque and dict based state, which also
+    grew with every event.
+    """
+    # A reading is a hydrate condition below this volume with the valve above this opening
+    VOLUME_THRESHOLD = 50
+    VALVE_THRESHOLD = 90
+
+    __slots__ = (
+        'window_size', 'cleaner', 'samples', 'head', 'size', 'pushes', 'time_origin',
+        'volume_stats', 'valve_stats', 'deviation_stats', 'current_event', 'detected_events', 'last_status'
+    )
+
+    def __init__(self, window_size=60, cleaner=None, max_events=10):  # Keep last 60 points for analysis
         self.window_size = window_size
-        
-        # Sliding windows for data
-        self.volume_window = deque(maxlen=window_size)
-        self.setpoint_window = deque(maxlen=window_size)
-        self.valve_window = deque(maxlen=window_size)
-        self.timestamp_window = deque(maxlen=window_size)
-        
+        self.cleaner = cleaner if cleaner is not None else StreamCleaner()
+
+        # Sliding window ring buffer, columns: seconds since time_origin, volume, setpoint, valve
+        self.samples = np.full((window_size, 4), np.nan)
+        self.head = 0
+        self.size = 0
+        self.pushes = 0
+        self.time_origin = None
+
+        # Rolling statistics over the window
+        self.volume_stats = RollingStats()
+        self.valve_stats = RollingStats()
+        self.deviation_stats = RollingStats()
+
         # Event tracking
         self.current_event = None
-        self.detected_events = []
-        
+        self.detected_events = deque(maxlen=max_events)
+
         # Initial state
-        self.last_status = {
-            "is_hydrate": False,
-            "event_status": None,
-            "current_metrics": None
-        }
-    
+        self.last_status = DetectionResult(self.detected_events)
+
+    @property
+    def window(self):
+        """Rows of the ring buffer, oldest first"""
+        if self.size < self.window_size:
+            return self.samples[:self.size]
+        return np.roll(self.samples, -self.head, axis=0)
+
+    @property
+    def timestamp_window(self):
+        return [self.time_origin + timedelta(seconds=seconds) for seconds in self.window[:, 0].tolist()]
+
+    @property
+    def volume_window(self):
+        return self.window[:, 1].tolist()
+
+    @property
+    def setpoint_window(self):
+        return self.window[:, 2].tolist()
+
+    @property
+    def valve_window(self):
+        return self.window[:, 3].tolist()
+
     def detect_hydrate_formation(self, volume, valve, current_time):
         """Detect hydrate formation from current values"""
-        volume_threshold = 50
-        valve_threshold = 90
-        
-        is_hydrate_condition = volume < volume_threshold and valve > valve_threshold
+        is_hydrate_condition = volume < self.VOLUME_THRESHOLD and valve > self.VALVE_THRESHOLD
         
         if is_hydrate_condition:
             if self.current_event is None:
@@ -56,36 +325,244 @@ class HydrateDetector:
             
         return False, ""
 
+    def process_raw(self, timestamp, volume, setpoint, valve):
+        """
+        Clean a raw reading and run detection on every point it releases.
+
+        Returns:
+            list: (timestamp, volume, setpoint, valve, is_hydrate, message, in_event)
+            per cleaned point, possibly empty while the cleaner waits for more data
+        """
+        return self._detect_points(self.cleaner.push(timestamp, volume, setpoint, valve))
+
+    def flush_raw(self):
+        """Release and run detection on every reading the cleaner still holds, same results as `process_raw`"""
+        return self._detect_points(self.cleaner.flush())
+
+    def _detect_points(self, points):
+        results = []
+        for timestamp, volume, setpoint, valve in points:
+            self.track(timestamp, volume, setpoint, valve)
+            is_hydrate, message = self.detect_hydrate_formation(volume, valve, timestamp)
+            results.append((timestamp, volume, setpoint, valve, is_hydrate, message, self.current_event is not None))
+        return results
+
+    def track(self, timestamp, volume, setpoint, valve):
+        """Add a point to the sliding window and its rolling statistics"""
+        if self.time_origin is None:
+            self.time_origin = timestamp
+        seconds = (timestamp - self.time_origin).total_seconds()
+        if setpoint is None:
+            setpoint = float('nan')
+
+        slot = self.head
+        if self.size == self.window_size:
+            old_seconds, old_volume, old_setpoint, old_valve = self.samples[slot].tolist()
+            self.volume_stats.remove(old_seconds, old_volume)
+            self.valve_stats.remove(old_seconds, old_valve)
+            self.deviation_stats.remove(old_seconds, old_setpoint - old_volume)
+        else:
+            self.size += 1
+        self.samples[slot] = (seconds, volume, setpoint, valve)
+        self.head = (slot + 1) % self.window_size
+
+        self.volume_stats.add(seconds, volume)
+        self.valve_stats.add(seconds, valve)
+        self.deviation_stats.add(seconds, setpoint - volume)
+
+        # Removals accumulate rounding error, start over from the window now and then
+        self.pushes += 1
+        if self.pushes % (100 * self.window_size) == 0:
+            self.rebuild_stats()
+
+    def rebuild_stats(self):
+        for stats in (self.volume_stats, self.valve_stats, self.deviation_stats):
+            stats.reset()
+        for seconds, volume, setpoint, valve in self.window.tolist():
+            self.volume_stats.add(seconds, volume)
+            self.valve_stats.add(seconds, valve)
+            self.deviation_stats.add(seconds, setpoint - volume)
+
+    def rolling_metrics(self, metrics=None):
+        """Mean, variance and slope (per minute) of volume, valve and setpoint deviation over the window"""
+        metrics = {} if metrics is None else metrics
+        for name, stats in (("volume", self.volume_stats), ("valve", self.valve_stats), ("setpoint_deviation", self.deviation_stats)):
+            slope = stats.slope()
+            metrics[f"{name}_mean"] = stats.mean()
+            metrics[f"{name}_variance"] = stats.variance()
+            metrics[f"{name}_slope"] = slope * 60 if slope is not None else None
+        return metrics
+
+    def last_tracked(self):
+        """Timestamp of the newest point in the window, None before the first one"""
+        if not self.size:
+            return None
+        return self.time_origin + timedelta(seconds=float(self.samples[(self.head - 1) % self.window_size, 0]))
+
+    def newest_reading(self):
+        """Timestamp of the newest raw reading fed through `process_raw`, held back or not"""
+        newest = self.cleaner.newest()
+        return newest if newest is not None else self.last_tracked()
+
+    def to_state(self):
+        """
+        JSON-serializable snapshot of everything detection depends on: the
+        window, the ongoing event and the cleaner's carried-over readings.
+        Readings the cleaner still holds back are left out, they are not
+        stored yet either. Rows stored after `last_tracked()` are replayed.
+        """
+        def value(number):
+            return None if number != number else float(number)
+
+        event = None
+        if self.current_event is not None:
+            event = {
+                'start_time': self.current_event['start_time'].isoformat(),
+                'initial_volume': value(self.current_event['initial_volume']),
+                'initial_valve': value(self.current_event['initial_valve'])
+            }
+        return {
+            'time_origin': self.time_origin.isoformat() if self.time_origin is not None else None,
+            'samples': [[value(number) for number in row] for row in self.window.tolist()],
+            'current_event': event,
+            'last_setpoint': value(self.cleaner.last_setpoint),
+            'last_valve': value(self.cleaner.last_valve)
+        }
+
+    def load_state(self, state):
+        """Restore a `to_state` snapshot into this (fresh) detector"""
+        if state['time_origin'] is not None:
+            self.time_origin = datetime.fromisoformat(state['time_origin'])
+        samples = np.array(state['samples'], dtype=float).reshape(-1, 4)[-self.window_size:]
+        self.samples[:len(samples)] = samples
+        self.size = len(samples)
+        self.head = len(samples) % self.window_size
+        self.rebuild_stats()
+
+        event = state['current_event']
+        if event is not None:
+            self.current_event = {
+                'start_time': datetime.fromisoformat(event['start_time']),
+                'initial_volume': event['initial_volume'],
+                'initial_valve': event['initial_valve']
+            }
+        self.cleaner.last_setpoint = np.nan if state['last_setpoint'] is None else state['last_setpoint']
+        self.cleaner.last_valve = np.nan if state['last_valve'] is None else state['last_valve']
+
+    def replay(self, timestamps, volume, setpoint, valve):
+        """
+        Catch up on stored rows in one batch. Rows are stored as the cleaner
+        released them, so they go straight through `detect_batch` and the
+        cleaner carries on from their last setpoint and valve.
+        """
+        if not len(timestamps):
+            return
+        volume = np.asarray(volume, dtype=float)
+        setpoint = np.asarray(setpoint, dtype=float)
+        valve = np.asarray(valve, dtype=float)
+        self.detect_batch(timestamps, volume, setpoint, valve)
+        for name, values in (('last_setpoint', setpoint), ('last_valve', valve)):
+            valid = values[~np.isnan(values)]
+            if len(valid):
+                setattr(self.cleaner, name, float(valid[-1]))
+
     def process_data_point(self, timestamp, volume, setpoint, valve):
         """Process a single data point and return detection results"""
         # Add to sliding windows
-        self.timestamp_window.append(timestamp)
-        self.volume_window.append(volume)
-        self.setpoint_window.append(setpoint)
-        self.valve_window.append(valve)
+        self.track(timestamp, volume, setpoint, valve)
         
         # Detect hydrate formation
         is_hydrate, message = self.detect_hydrate_formation(volume, valve, timestamp)
         
-        # Calculate current metrics
-        metrics = {
-            "volume": volume,
-            "setpoint": setpoint,
-            "valve": valve,
-            "volume_deviation": setpoint - volume if setpoint is not None else None,
-            "timestamp": timestamp.isoformat()
-        }
-        
+        # Calculate current metrics, reusing the result of the previous point
+        result = self.last_status
+        metrics = result.current_metrics
+        if metrics is None:
+            metrics = result.current_metrics = {}
+        metrics["volume"] = volume
+        metrics["setpoint"] = setpoint
+        metrics["valve"] = valve
+        metrics["volume_deviation"] = setpoint - volume if setpoint is not None else None
+        self.rolling_metrics(metrics)
+        metrics["timestamp"] = timestamp.isoformat()
+
         # Update status
-        self.last_status = {
-            "is_hydrate": is_hydrate,
-            "event_status": message if message else "Normal operation",
-            "current_metrics": metrics,
-            "current_event": self.current_event,
-            "recent_events": self.detected_events[-5:] if self.detected_events else []  # Last 5 events
+        result.is_hydrate = is_hydrate
+        result.event_status = message if message else "Normal operation"
+        result.current_event = self.current_event
+
+        return result
+
+    def detect_batch(self, timestamps, volume, setpoint, valve):
+        """
+        Vectorized equivalent of calling `process_data_point` for every row of a
+        time series, continuing from (and updating) the detector's current state.
+
+        Args:
+            timestamps: Sequence of timestamps, one per row
+            volume: Sequence of gas meter volumes, None is treated as missing
+            setpoint: Sequence of volume setpoints
+            valve: Sequence of valve open percentages
+
+        Returns:
+            dict: `is_hydrate` (bool array), `event_status` (object array with the
+            same messages as `detect_hydrate_formation`) and `events`, the hydrate
+            events completed within the batch
+        """
+        volume = np.asarray(volume, dtype=float)
+        setpoint = np.asarray(setpoint, dtype=float)
+        valve = np.asarray(valve, dtype=float)
+        count = len(volume)
+
+        # NaN comparisons are False, which matches a missing reading not being a hydrate
+        with np.errstate(invalid='ignore'):
+            condition = (volume < self.VOLUME_THRESHOLD) & (valve > self.VALVE_THRESHOLD)
+
+        in_event_before = np.empty(count, dtype=bool)
+        if count:
+            in_event_before[0] = self.current_event is not None
+            in_event_before[1:] = condition[:-1]
+        starts = np.flatnonzero(condition & ~in_event_before)
+        ends = np.flatnonzero(~condition & in_event_before)
+
+        event_status = np.full(count, "", dtype=object)
+        event_status[starts] = "ALERT: Hydrate formation detected!"
+        event_status[ends] = "Hydrate event ended"
+
+        # Walk the (few) events rather than the rows to keep the event history in sync
+        events = []
+        start_iter = iter(starts)
+        for end in ends:
+            if self.current_event is None:
+                start = next(start_iter)
+                self.current_event = {
+                    'start_time': timestamps[start],
+                    'initial_volume': float(volume[start]),
+                    'initial_valve': float(valve[start])
+                }
+            self.current_event['end_time'] = timestamps[end]
+            self.current_event['final_volume'] = float(volume[end])
+            self.current_event['final_valve'] = float(valve[end])
+            self.current_event['duration'] = (timestamps[end] - self.current_event['start_time']).total_seconds()
+            self.detected_events.append(self.current_event)
+            events.append(self.current_event)
+            self.current_event = None
+        for start in start_iter:
+            self.current_event = {
+                'start_time': timestamps[start],
+                'initial_volume': float(volume[start]),
+                'initial_valve': float(valve[start])
+            }
+
+        # Only the last window_size points can still be in the windows
+        for i in range(max(count - self.window_size, 0), count):
+            self.track(timestamps[i], float(volume[i]), float(setpoint[i]), float(valve[i]))
+
+        return {
+            "is_hydrate": event_status != "",
+            "event_status": event_status,
+            "events": events
         }
-        
-        return self.last_status
 
 # Create global detector instance
 detector = HydrateDetector()
@@ -116,7 +593,7 @@ def detect_hydrate():
             valve=float(data['valve'])
         )
         
-        return jsonify(result)
+        return jsonify(result.to_dict())
     
     except Exception as e:
         return jsonify({
@@ -126,13 +603,13 @@ def detect_hydrate():
 @app.route('/api/detector-status', methods=['GET'])
 def get_status():
     """Get current detector status without processing new data"""
-    return jsonify(detector.last_status)
+    return jsonify(detector.last_status.to_dict())
 
 @app.route('/api/recent-events', methods=['GET'])
 def get_recent_events():
     """Get list of recent hydrate events"""
     return jsonify({
-        'events': detector.detected_events[-10:]  # Last 10 events
+        'events': list(detector.detected_events)[-10:]  # Last 10 events
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,252 @@
+# bench.py
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+import socketio
+
+TIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+
+def raw(value):
+    """A CSV cell as sent over the wire, missing readings as None (null)"""
+    return None if pd.isna(value) else float(value)
+
+
+def load_wells(data_dir, wells, rows_per_well=None):
+    """
+    Build `wells` simulated wells out of the CSVs in `data_dir`, cycling through
+    the files and shifting every copy by a week so no two wells overlap.
+    Readings are sent raw, gaps as null, the way devices send them, so the
+    server's cleaner does its share of the work.
+    """
+    frames = []
+    for csv_path in sorted(glob.glob(os.path.join(data_dir, '*.csv'))):
+        df = pd.read_csv(csv_path)
+        df['Time'] = pd.to_datetime(df['Time'], format='%m/%d/%Y %I:%M:%S %p')
+        frames.append(df.dropna(subset=['Time']))
+
+    well_rows = []
+    for well in range(wells):
+        df = frames[well % len(frames)]
+        if rows_per_well:
+            df = df.head(rows_per_well)
+        shifted = (df['Time'] + timedelta(weeks=well // len(frames))).dt.strftime(TIME_FORMAT)
+        well_rows.append([
+            {
+                'Time': timestamp,
+                'Inj Gas Meter Volume Instantaneous': raw(volume),
+                'Inj Gas Meter Volume Setpoint': raw(setpoint),
+                'Inj Gas Valve Percent Open': raw(valve),
+            }
+            for timestamp, volume, setpoint, valve in zip(
+                shifted,
+                df['Inj Gas Meter Volume Instantaneous'],
+                df['Inj Gas Meter Volume Setpoint'],
+                df['Inj Gas Valve Percent Open'],
+            )
+        ])
+    return well_rows
+
+
+class BenchClient:
+    """
+    One Socket.IO connection replaying several wells, recording ack latencies.
+    It connects with the first well's device_id, which the load balancer
+    hashes to pick a replica, so all of its wells stay on that replica.
+    """
+
+    def __init__(self, server_url, email, password, wells):
+        self.sio = socketio.Client()
+        self.server_url = server_url
+        self.email = email
+        self.password = password
+        self.wells = wells  # [(device_id, rows)]
+        self.authenticated = threading.Event()
+        self.ack_latencies = []
+        self.rejected = {}  # server error -> count
+        self.sent = 0
+        self.alert_candidates = {}
+        self.lock = threading.Lock()
+
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('authentication_success', lambda data: self.authenticated.set())
+
+    def on_connect(self):
+        self.sio.emit('authenticate', {'email': self.email, 'password': self.password})
+
+    def connect(self, timeout=10):
+        self.sio.connect(f"{self.server_url}?device_id={self.wells[0][0]}")
+        return self.authenticated.wait(timeout)
+
+    def run(self, rate):
+        """Interleave the wells row by row, `rate` rows per second per well (0 = as fast as possible)"""
+        interval = 1.0 / rate if rate else 0
+        longest = max(len(rows) for _, rows in self.wells)
+        for i in range(longest):
+            started = time.monotonic()
+            for device_id, rows in self.wells:
+                if i >= len(rows) or not self.sio.connected:
+                    continue
+                data = dict(rows[i], email=self.email, device_id=device_id)
+                sent_at = time.monotonic()
+                volume, valve = data['Inj Gas Meter Volume Instantaneous'], data['Inj Gas Valve Percent Open']
+                # Approximate, the server detects on cleaned points, e.g. with an interpolated valve
+                if volume is not None and valve is not None and volume < 50 and valve > 90:
+                    self.alert_candidates[(device_id, data['Time'])] = time.time()
+                self.sio.emit('data', data, callback=lambda response=None, sent_at=sent_at: self.on_ack(sent_at, response))
+                self.sent += 1
+            if interval:
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+
+    def on_ack(self, sent_at, response):
+        """Only rows the server queued count as acked, the others are tallied by error"""
+        with self.lock:
+            if response and response.get('queued'):
+                self.ack_latencies.append((time.monotonic() - sent_at) * 1000)
+            else:
+                error = (response or {}).get('error', 'No reply')
+                self.rejected[error] = self.rejected.get(error, 0) + 1
+
+    def answered(self):
+        return len(self.ack_latencies) + sum(self.rejected.values())
+
+    def close(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+def ingest_stats(server_url, device_ids):
+    """
+    Ingest stats of every replica the clients reached, by worker. A health
+    check carrying a client's device_id is routed to that client's replica.
+    """
+    stats = {}
+    for device_id in device_ids:
+        try:
+            health = requests.get(f"{server_url}/api/health", params={'device_id': device_id}, timeout=5).json()
+        except Exception:
+            continue
+        stats[health.get('worker')] = health.get('ingest', {})
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay data/ as many wells against the backend and report throughput')
+    parser.add_argument('--server', default='http://0.0.0.0:9090')
+    parser.add_argument('--email', default='sampleuser@example.com')
+    parser.add_argument('--password', default='SampleUser@123')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+    parser.add_argument('--wells', type=int, default=9)
+    parser.add_argument('--clients', type=int, default=0, help='connections, wells are spread over them, 0 for one per well')
+    parser.add_argument('--rate', type=float, default=0, help='rows per second per well, 0 for no pause')
+    parser.add_argument('--rows-per-well', type=int, default=None)
+    parser.add_argument('--drain-timeout', type=float, default=30, help='seconds to wait for outstanding acks')
+    parser.add_argument('--output', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    wells = load_wells(args.data_dir, args.wells, args.rows_per_well)
+    device_wells = [(f"bench-{i:04d}", rows) for i, rows in enumerate(wells)]
+    # Connections are what the load balancer spreads over replicas
+    connections = min(args.clients or len(device_wells), len(device_wells))
+    clients = [
+        BenchClient(args.server, args.email, args.password, device_wells[i::connections])
+        for i in range(connections)
+    ]
+    for client in clients:
+        if not client.connect():
+            raise SystemExit("Authentication failed, check Email and Password")
+
+    device_ids = [client.wells[0][0] for client in clients]
+    health_before = ingest_stats(args.server, device_ids)
+    started = time.monotonic()
+    threads = [threading.Thread(target=client.run, args=(args.rate,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    send_duration = time.monotonic() - started
+
+    rows_sent = sum(client.sent for client in clients)
+    deadline = time.monotonic() + args.drain_timeout
+    while sum(client.answered() for client in clients) < rows_sent and time.monotonic() < deadline:
+        time.sleep(0.1)
+    duration = time.monotonic() - started
+    # Give the ingest buffer a moment to flush the tail
+    time.sleep(1)
+    health_after = ingest_stats(args.server, device_ids)
+
+    ack_latencies = [latency for client in clients for latency in client.ack_latencies]
+    rejected = {}
+    for client in clients:
+        for error, count in client.rejected.items():
+            rejected[error] = rejected.get(error, 0) + count
+    report = {
+        'config': vars(args),
+        'rows_sent': rows_sent,
+        'rows_acked': len(ack_latencies),
+        'rows_rejected': rejected,
+        'send_duration_s': round(send_duration, 3),
+        'duration_s': round(duration, 3),
+        'throughput_rows_per_s': round(rows_sent / send_duration, 1) if send_duration else None,
+        'ack_latency_ms': percentiles(ack_latencies),
+    }
+
+    rows_flushed = sum(
+        stats.get('rows_flushed', 0) - health_before.get(worker, {}).get('rows_flushed', 0)
+        for worker, stats in health_after.items()
+    )
+    report['replicas'] = len(health_after)
+    report['db_rows_written'] = rows_flushed
+    # Acked rows the database has not got, each well's cleaner still holds its last reading or two
+    report['rows_unwritten'] = max(0, len(ack_latencies) - rows_flushed)
+    report['db_rows_per_s'] = round(rows_flushed / duration, 1) if duration else None
+
+    # Alert latency is only observable when the backend runs with ALERT_TRANSPORT=memory
+    try:
+        alerts = requests.get(f"{args.server}/api/debug/alerts", params={'limit': 10000}, timeout=5).json()['alerts']
+        candidates = {}
+        for client in clients:
+            candidates.update(client.alert_candidates)
+        alert_latencies = [
+            (alert['published_at'] - candidates[(alert['message']['device_id'], alert['message']['timestamp'])]) * 1000
+            for alert in alerts
+            if (alert['message']['device_id'], alert['message']['timestamp']) in candidates
+        ]
+        report['alerts'] = len(alert_latencies)
+        report['alert_latency_ms'] = percentiles(alert_latencies)
+    except Exception:
+        report['alerts'] = None
+        report['alert_latency_ms'] = None
+
+    for client in clients:
+        client.close()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,77 @@
 # client.py
 import socketio
 import pandas as pd
+import threading
 import time
+import uuid
+from collections import OrderedDict
+
+BATCH_COLUMNS = ['time', 'volume', 'setpoint', 'valve']
+
+
+def nullable(value):
+    return None if pd.isna(value) else float(value)
 
 class CSVStreamer:
-    def __init__(self, csv_path, email, password, device_id, server_url='http://0.0.0.0:9090'):
+    def __init__(self, csv_path, email, password, device_id, server_url='http://0.0.0.0:9090', token=None):
         self.sio = socketio.Client()
         self.csv_path = csv_path
         self.server_url = server_url
         self.email = email
         self.password = password
+        # JWT from /api/login, skips the password check on every (re)connect
+        self.token = token
         self.authenticated = False
         self.device_id = device_id
+
+        # data_batch state: seq -> batch not yet acknowledged as stored,
+        # numbered from 0 within a session that is renewed on every (re)connect
+        self.session = uuid.uuid4().hex
+        self.seq = 0
+        self.unacked = OrderedDict()
+        self.unacked_lock = threading.Lock()
+        self.resend_scheduled = False
         
         # Set up Socket.IO event handlers
         self.sio.on('connect', self.on_connect)
         self.sio.on('disconnect', self.on_disconnect)
         self.sio.on('authentication_success', self.on_authentication_success)
+        self.sio.on('authentication_retry', self.on_authentication_retry)
+        self.sio.on('data_ack', self.on_batch_ack)
         
     def on_connect(self):
+        if self.token:
+            self.sio.emit('authenticate', {'token': self.token})
+            return
         self.sio.emit('authenticate', {
             'email': self.email,
             'password': self.password
         })
+
+    def on_authentication_retry(self, data):
+        print(f"Server busy, retrying authentication in {data['retry_after']}s")
+        self.sio.start_background_task(self.retry_authentication, data['retry_after'])
+
+    def retry_authentication(self, delay):
+        time.sleep(delay)
+        if self.sio.connected:
+            self.on_connect()
     
     def on_authentication_success(self, data) :
         print('Authentication successful')
         self.authenticated = True
+        self.start_session()
+        self.resend_unacked()
     
         
     def on_disconnect(self):
         print('Disconnected from server')
+        self.authenticated = False
         
     def connect_to_server(self):
         try:
-            self.sio.connect(self.server_url)
+            # The device id lets the load balancer keep a well on one backend
+            self.sio.connect(f"{self.server_url}?device_id={self.device_id}")
             time.sleep(1)
             print(self.authenticated)
             if not self.authenticated:
@@ -54,9 +91,8 @@ class CSVStreamer:
             df = pd.read_csv(self.csv_path)
             # df['Time'] = pd.to_datetime(df['Time'], format='%m/%d/%Y %I:%M:%S %p')
 
-            # Fill missing values
-            df['Inj Gas Meter Volume Setpoint'] = df['Inj Gas Meter Volume Setpoint'].ffill()
-            df['Inj Gas Valve Percent Open'] = df['Inj Gas Valve Percent Open'].interpolate()
+            # Gaps are sent as null like a field device would, the server cleans them
+            df = df.astype(object).where(df.notna(), None)
             
             # Stream each row
             for _, row in df.iterrows():
@@ -80,6 +116,110 @@ class CSVStreamer:
             if self.sio.connected:
                 self.sio.disconnect()
 
+    def on_batch_ack(self, response):
+        """Server ack, every batch of the session up to response['ack'] is stored"""
+        if response.get('session') != self.session:
+            # Reply to a batch of an earlier session, whose numbers are gone
+            return
+        if response.get('rejected'):
+            print(f"Batches {response['rejected']} were rejected by the server")
+        acked = response.get('ack', -1)
+        with self.unacked_lock:
+            for seq in [seq for seq in self.unacked if seq <= acked]:
+                del self.unacked[seq]
+        if response.get('error'):
+            print(f"Batch not stored: {response['error']}")
+            self.schedule_resend()
+
+    def send_batch(self, batch):
+        self.sio.emit('data_batch', batch, callback=self.on_batch_ack)
+
+    def start_session(self):
+        """Renumber the unacknowledged batches from 0 under a new session"""
+        with self.unacked_lock:
+            self.session = uuid.uuid4().hex
+            pending = list(self.unacked.values())
+            self.unacked = OrderedDict()
+            for seq, batch in enumerate(pending):
+                batch['session'] = self.session
+                batch['seq'] = seq
+                self.unacked[seq] = batch
+            self.seq = len(pending)
+
+    def resend_unacked(self):
+        """After a (re)connect, resend everything the server has not acknowledged"""
+        with self.unacked_lock:
+            pending = list(self.unacked.values())
+        if pending:
+            print(f"Resending {len(pending)} unacknowledged batches")
+        for batch in pending:
+            self.send_batch(batch)
+
+    def schedule_resend(self, delay=1.0):
+        """Once per burst of errors, resend what is unacknowledged under a new session"""
+        with self.unacked_lock:
+            if self.resend_scheduled:
+                return
+            self.resend_scheduled = True
+        self.sio.start_background_task(self.resend_later, delay)
+
+    def resend_later(self, delay):
+        time.sleep(delay)
+        self.resend_scheduled = False
+        if self.sio.connected and self.authenticated:
+            # The server skips rows it already has, so nothing is stored twice
+            self.start_session()
+            self.resend_unacked()
+
+    def stream_batches(self, batch_size=100, max_in_flight=10, ack_timeout=30):
+        """
+        Stream the CSV as `data_batch` events of `batch_size` rows, with at most
+        `max_in_flight` batches waiting for an ack. Batches stay buffered until
+        acknowledged and are resent after a reconnect or an error. The last
+        batch asks the server to flush, so the readings its cleaner holds back
+        are stored and acknowledged too.
+        """
+        df = pd.read_csv(self.csv_path)
+        # Epoch milliseconds are cheaper to parse on the server than formatted strings
+        epoch_ms = (pd.to_datetime(df['Time'], format='%m/%d/%Y %I:%M:%S %p') - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+        rows = [
+            [int(timestamp), nullable(volume), nullable(setpoint), nullable(valve)]
+            for timestamp, volume, setpoint, valve in zip(
+                epoch_ms,
+                df['Inj Gas Meter Volume Instantaneous'],
+                df['Inj Gas Meter Volume Setpoint'],
+                df['Inj Gas Valve Percent Open'],
+            )
+        ]
+
+        try:
+            for start in range(0, len(rows), batch_size):
+                while len(self.unacked) >= max_in_flight:
+                    time.sleep(0.05)
+                with self.unacked_lock:
+                    batch = {
+                        'device_id': self.device_id,
+                        'session': self.session,
+                        'seq': self.seq,
+                        'columns': BATCH_COLUMNS,
+                        'rows': rows[start:start + batch_size],
+                        'flush': start + batch_size >= len(rows),
+                    }
+                    self.unacked[self.seq] = batch
+                    self.seq += 1
+                if self.sio.connected and self.authenticated:
+                    self.send_batch(batch)
+                print(f"Sent batch {batch['seq']} ({len(batch['rows'])} rows)")
+
+            deadline = time.monotonic() + ack_timeout
+            while self.unacked and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if self.unacked:
+                print(f"{len(self.unacked)} batches were not acknowledged")
+        finally:
+            if self.sio.connected:
+                self.sio.disconnect()
+
 if __name__ == '__main__':
     # Example usage
     csv_path = '../data/Gallant_102H-10_04-10_11.csv'  # Replace with your CSV file path
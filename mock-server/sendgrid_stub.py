@@ -0,0 +1,53 @@
+# sendgrid_stub.py
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SendGridStub(BaseHTTPRequestHandler):
+    """
+    Minimal local stand-in for SendGrid's `POST /v3/mail/send`.
+    Point the email worker at it with SENDGRID_HOST=http://localhost:8025,
+    `GET /stats` returns how many emails and recipients it received.
+    """
+    lock = threading.Lock()
+    emails = 0
+    recipients = 0
+
+    def do_POST(self):
+        if self.path != '/v3/mail/send':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with SendGridStub.lock:
+            SendGridStub.emails += 1
+            SendGridStub.recipients += sum(len(p.get('to', [])) for p in body.get('personalizations', []))
+
+        # SendGrid answers an accepted message with an empty 202
+        self.send_response(202)
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = json.dumps({'emails': SendGridStub.emails, 'recipients': SendGridStub.recipients}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    print(f"SendGrid stub listening on http://0.0.0.0:{port}")
+    ThreadingHTTPServer(('0.0.0.0', port), SendGridStub).serve_forever()
@@ -3,74 +3,193 @@ import pika, sys, os, json
 from datetime import datetime
 import os
 from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from sendgrid.helpers.mail import Mail, Personalization, Substitution, To
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 import socket
 import docker
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def send_email(message_dict):
-    # Get the current date and time
-    to_email = message_dict['email']
+# Compiled once at startup, autoescaping keeps device ids and values from injecting markup
+template_env = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+    autoescape=select_autoescape(['html'])
+)
+alert_template = template_env.get_template('alert_email.html')
 
+# Replaced per recipient by SendGrid, so one rendered body serves every recipient
+RECIPIENT_PLACEHOLDER = '-recipient_email-'
+
+sendgrid_client = None
+
+class CapturingMailClient:
+    """
+    Stand-in for SendGridAPIClient that keeps the request bodies instead of
+    sending them, for load tests without SendGrid credentials.
+    """
+
+    class Response:
+        status_code = 202
+
+    def __init__(self, max_messages=10000):
+        self.messages = deque(maxlen=max_messages)
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.messages.append(message.get())
+            self.sent += 1
+        return self.Response()
+
+def create_mail_client():
+    """
+    Mail client selected by MAIL_TRANSPORT: `sendgrid` (optionally pointed at
+    a local stub through SENDGRID_HOST) or `capture`
+    """
+    transport = os.getenv('MAIL_TRANSPORT', 'sendgrid')
+    if transport == 'capture':
+        return CapturingMailClient()
+    if transport != 'sendgrid':
+        raise ValueError(f"Unknown MAIL_TRANSPORT {transport}, expected sendgrid or capture")
+    if os.getenv('SENDGRID_HOST'):
+        return SendGridAPIClient(os.getenv('SENDGRID_API_KEY') or 'local-stub', host=os.getenv('SENDGRID_HOST'))
+    return SendGridAPIClient(os.getenv('SENDGRID_API_KEY'))
+
+def send_email(to_emails, messages):
+    """
+    Send one email covering every alert in `messages` to each of `to_emails`,
+    as a single SendGrid request with one personalization per recipient.
+    Returns True on success.
+    """
     current_datetime = datetime.now()
 
     # Format date and time together
     formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
 
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Gas Meter Data</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                margin: 20px;
-            }}
-            h1 {{
-                color: #333;
-            }}
-            .data-container {{
-                border: 1px solid #ccc;
-                padding: 15px;
-                border-radius: 8px;
-                background-color: #f9f9f9;
-                width: 350px;
-            }}
-            .data-container p {{
-                margin: 8px 0;
-            }}
-            .label {{
-                font-weight: bold;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1>Gas Meter Data</h1>
-        <div class="data-container">
-            <p><span class="label">Email:</span> <span id="email">{to_email}</span></p>
-            <p><span class="label">Gas Meter Volume (Instant):</span> <span id="gas_meter_volume_instant">{message_dict['gas_meter_volume_instant']}</span></p>
-            <p><span class="label">Gas Valve Open (%):</span> <span id="gas_valve_percent_open">{message_dict['gas_valve_percent_open']}</span></p>
-            <p><span class="label">Timestamp:</span> <span id="timestamp">{message_dict['timestamp']}</span></p>
-            <p><span class="label">Device ID:</span> <span id="device_id">{message_dict['device_id']}</span></p>
-        </div>
-    </body>
-    </html>
-    """
+    subject = f'Hydrate is being Caused at {formatted_datetime}'
+    if len(messages) > 1:
+        subject = f'{len(messages)} Hydrate alerts as of {formatted_datetime}'
 
     message = Mail(
     from_email=os.getenv('SENDGRID_FROM_EMAIL'),
-    to_emails=to_email,
-    subject=f'Hydrate is being Caused at {formatted_datetime}',
-    html_content=html_content)
+    subject=subject,
+    html_content=alert_template.render(alerts=messages, recipient_placeholder=RECIPIENT_PLACEHOLDER))
+    for to_email in to_emails:
+        personalization = Personalization()
+        personalization.add_to(To(to_email))
+        personalization.add_substitution(Substitution(RECIPIENT_PLACEHOLDER, to_email))
+        message.add_personalization(personalization)
+
+    recipients = ", ".join(to_emails)
     try:
-        sg = SendGridAPIClient(os.getenv('SENDGRID_API_KEY'))
-        response = sg.send(message)
+        response = sendgrid_client.send(message)
         if 200 <= int(response.status_code) <= 299:
-            print(f"{datetime.now()} - Sent Email to {to_email}")
+            print(f"{datetime.now()} - Sent Email to {recipients}")
+            return True
+        print(f"{datetime.now()} - SendGrid answered {response.status_code} for {recipients}")
     except Exception as e:
-        print(f"{datetime.now()} - Error generate while sending email to {to_email}")
+        print(f"{datetime.now()} - Error generate while sending email to {recipients}: {e}")
+    return False
+
+class EmailConsumer:
+    """
+    Consumes the email queue with manual acks. Alerts for the same recipient
+    arriving within `digest_window` seconds are coalesced into one email,
+    recipients with identical digests share one API request, emails are
+    sent concurrently on a thread pool, and failed alerts are
+    republished up to `max_retries` times before landing in the dead-letter
+    queue.
+
+    Messages stay unacked until their email is sent, so at most `prefetch`
+    are in a digest, being sent or waiting for a retry. A digest is flushed
+    early once it holds `digest_size` alerts, kept below `prefetch` so the
+    broker still has room to deliver while the previous digest is sent and
+    a burst does not stall until the window ends. Alerts waiting for a
+    retry do not count, so while SendGrid fails the consumer keeps batching
+    over the window instead of sending every new alert on its own.
+
+    Every pika call happens on the connection's thread, pool threads hand
+    their results back through `add_callback_threadsafe`.
+    """
+
+    def __init__(self, connection, queue_name='email', workers=8, prefetch=50,
+                 digest_window=5, digest_size=None, max_retries=3, retry_delay=10):
+        self.connection = connection
+        self.channel = connection.channel()
+        self.queue_name = queue_name
+        self.dead_letter_queue = f"{queue_name}.dead"
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.prefetch = prefetch
+        self.digest_size = max(min(digest_size or prefetch // 2, prefetch - 1), 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.digests = {}
+        self.digested = 0  # Alerts in `digests`
+        self.flush_timer = None
+
+        self.channel.queue_declare(queue=queue_name)
+        self.channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        self.channel.basic_qos(prefetch_count=prefetch)
+
+    def start(self):
+        self.channel.basic_consume(queue=self.queue_name, on_message_callback=self.on_message)
+        self.channel.start_consuming()
+
+    def on_message(self, ch, method, properties, body):
+        message_dict = json.loads(body.decode('utf-8'))
+        retries = (properties.headers or {}).get('x-retries', 0)
+        if not self.digests:
+            self.flush_timer = self.connection.call_later(self.digest_window, self.flush)
+        self.digests.setdefault(message_dict['email'], []).append((method.delivery_tag, message_dict, body, retries))
+        self.digested += 1
+        if self.digested >= self.digest_size:
+            self.flush()
+
+    def flush(self):
+        if self.flush_timer is not None:
+            self.connection.remove_timeout(self.flush_timer)
+            self.flush_timer = None
+        digests, self.digests = self.digests, {}
+        self.digested = 0
+
+        # Recipients whose digests hold the same alerts share one SendGrid request
+        batches = {}
+        for to_email, alerts in digests.items():
+            content = json.dumps([{k: v for k, v in alert[1].items() if k != 'email'} for alert in alerts], sort_keys=True)
+            batch = batches.setdefault(content, {'recipients': [], 'messages': [alert[1] for alert in alerts], 'alerts': []})
+            batch['recipients'].append(to_email)
+            batch['alerts'].extend(alerts)
+
+        for batch in batches.values():
+            future = self.pool.submit(send_email, batch['recipients'], batch['messages'])
+            future.add_done_callback(
+                lambda done, alerts=batch['alerts']: self.connection.add_callback_threadsafe(
+                    lambda: self.settle(alerts, not done.exception() and done.result())
+                )
+            )
+
+    def settle(self, alerts, sent):
+        for delivery_tag, message_dict, body, retries in alerts:
+            if sent:
+                self.channel.basic_ack(delivery_tag=delivery_tag)
+            elif retries < self.max_retries:
+                # Stays unacked until it is requeued, so a crash meanwhile does not lose it
+                self.connection.call_later(
+                    self.retry_delay * (retries + 1),
+                    lambda delivery_tag=delivery_tag, body=body, retries=retries:
+                        self.republish(delivery_tag, self.queue_name, body, retries + 1)
+                )
+            else:
+                print(f"{datetime.now()} - Giving up on alert for {message_dict['email']}, moving it to {self.dead_letter_queue}")
+                self.republish(delivery_tag, self.dead_letter_queue, body, retries)
+
+    def republish(self, delivery_tag, queue_name, body, retries):
+        self.channel.basic_publish(exchange='', routing_key=queue_name, body=body,
+                                   properties=pika.BasicProperties(headers={'x-retries': retries}))
+        self.channel.basic_ack(delivery_tag=delivery_tag)
 
 def main():
     print("Rabbit Port Value found : ", os.getenv('RABBIT_PORT'))
@@ -85,18 +204,22 @@ def main():
     except Exception as e:
         raise e
     
-    channel = connection.channel()
-
-    channel.queue_declare(queue='email')
-
-    def callback(ch, method, properties, body):
-        message_dict = json.loads(body.decode('utf-8'))
-        send_email(message_dict)
+    # One client for the whole process instead of one per email
+    global sendgrid_client
+    sendgrid_client = create_mail_client()
 
-    channel.basic_consume(queue='email', on_message_callback=callback, auto_ack=True)
+    consumer = EmailConsumer(
+        connection,
+        workers=int(os.getenv('EMAIL_WORKERS', 8)),
+        prefetch=int(os.getenv('EMAIL_PREFETCH', 50)),
+        digest_window=float(os.getenv('EMAIL_DIGEST_WINDOW', 5)),
+        digest_size=int(os.getenv('EMAIL_DIGEST_SIZE', 0)) or None,
+        max_retries=int(os.getenv('EMAIL_MAX_RETRIES', 3)),
+        retry_delay=float(os.getenv('EMAIL_RETRY_DELAY', 10))
+    )
 
     print(' [*] Waiting for messages. To exit press CTRL+C')
-    channel.start_consuming()
+    consumer.start()
 
 if __name__ == '__main__':
     try: